@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+中心分析引擎一致性校验
+以urban_center.py中的原有函数(reclassify、calc_index、explore_center、func_decider)为基准，
+在生成数据及实际数据上运行替代引擎，按容差对比结果并统计加速比
+用法: python engine_check.py [--geo 范围.geojson --poi POI1.csv POI2.csv] [--cellsize 500] [--size 20000]
+"""
+
+import argparse
+import sys
+import time
+from functools import partial
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+import urban_center as uc
+
+#分块引擎校验的分块边长，8、16小于生成数据的网格行列数，用于校验缓冲网格及跨分块的中心合并，64时为单一分块
+TILE_SIZES = [8, 16, 64]
+
+#核密度引擎校验所用的参数，网格大小为500米时高斯核半径为6个网格，缓冲网格跨越相邻分块
+KDE_PARAMS = {'weight': 'CI', 'kernel': '高斯', 'bandwidth': 1000, 'quantile': 0.9}
+
+#各字段的允许误差
+TOLERANCES = {'id': 0, 'De*': 1e-9, 'Di*': 1e-9, 'CI': 1e-9, 'Z': 1e-6, 'P': 1e-9, 'density': 1e-9, 'area': 1e-6, 'num_poi': 0, 'LQ': 1e-9}
+
+#生成数据所用的POI类别及名称，覆盖各大类的主要重分类规则
+VOCABULARY = [
+    ('餐饮服务;中餐厅;中餐厅', '川菜馆'), ('餐饮服务;快餐厅;快餐厅', '快餐店'), ('餐饮服务;咖啡厅;咖啡厅', '咖啡'),
+    ('购物服务;超级市场;超市', '沃尔玛超市'), ('购物服务;便民商店/便利店;便利店', '美宜佳便利店'), ('购物服务;商场;购物中心', '万象城'),
+    ('购物服务;专卖店;专营店', '专卖店'), ('购物服务;购物相关场所;购物相关场所', '水果店'),
+    ('生活服务;美容美发店;美容美发店', '美发沙龙'), ('生活服务;生活服务场所;生活服务场所', '菜鸟驿站'), ('生活服务;物流速递;物流速递', '快递'),
+    ('住宿服务;宾馆酒店;五星级宾馆', '大酒店'), ('住宿服务;宾馆酒店;经济型连锁酒店', '快捷酒店'), ('住宿服务;旅馆招待所;旅馆招待所', '招待所'),
+    ('体育休闲服务;运动场馆;综合体育馆', '体育馆'), ('体育休闲服务;影剧院;电影院', '影城'), ('体育休闲服务;娱乐场所;KTV', 'KTV'),
+    ('医疗保健服务;综合医院;三级甲等医院', '人民医院'), ('医疗保健服务;诊所;诊所', '诊所'), ('医疗保健服务;医药保健销售店;药房', '大药房'),
+    ('政府机构及社会团体;政府机关;区县级政府及事业单位', '区政府'), ('政府机构及社会团体;公检法机构;公安警察', '派出所'),
+    ('科教文化服务;学校;中学', '中学'), ('科教文化服务;培训机构;培训机构', '英语培训'), ('科教文化服务;博物馆;博物馆', '博物馆'),
+    ('商务住宅;住宅区;住宅小区', '花园小区'), ('商务住宅;楼宇;商务写字楼', '大厦'), ('商务住宅;产业园区;产业园区', '科技园'),
+    ('公司企业;公司;公司', '科技有限公司'), ('公司企业;工厂;工厂', '电子厂'),
+    ('金融保险服务;银行;中国工商银行', '工商银行'), ('金融保险服务;保险公司;保险公司', '人寿保险'), ('金融保险服务;财务公司;财务公司', '财务有限公司'),
+    ('风景名胜;公园广场;公园', '公园'), ('交通设施服务;地铁站;地铁站', '地铁站'),
+]
+
+def generate_input(size, seed=0):
+    '''
+    Goals: 生成与原始POI文件字段一致的测试数据，POI围绕若干中心聚集并叠加随机分布
+    Args:
+        size[int]: POI数量
+        seed[int]: 随机种子
+    Returns:
+        df[dataframe]: 原始POI数据
+        dfy[geodataframe]: WGS84坐标的分析范围
+    '''
+    rng = np.random.default_rng(seed)
+    west, south, east, north = 113.85, 22.5, 114.05, 22.65
+    centers = rng.uniform([west+0.02, south+0.02], [east-0.02, north-0.02], size=(6, 2))
+    cluster = rng.integers(0, 7, size)
+    points = np.where(cluster[:, None] < 6,
+                      centers[np.minimum(cluster, 5)] + rng.normal(0, 0.008, (size, 2)),
+                      rng.uniform([west, south], [east, north], (size, 2)))
+    words = rng.integers(0, len(VOCABULARY), size)
+    df = pd.DataFrame({'id': [str(i) for i in range(size)],
+                       'name': [VOCABULARY[w][1]+str(i) for i, w in enumerate(words)],
+                       'address': ['地址'+str(i) for i in range(size)],
+                       'type': [VOCABULARY[w][0] for w in words],
+                       'wgslng': points[:, 0], 'wgslat': points[:, 1]})
+    dfy = gpd.GeoDataFrame(geometry=[box(west, south, east, north)], crs='EPSG:4326')
+    return df, dfy
+
+def load_input(geo, pois):
+    '''
+    Goals: 读取实际数据，与中心分析模式的读取方式一致
+    Returns:
+        df[geodataframe]: 分析范围内的POI数据
+        dfy[geodataframe]: 投影坐标的分析范围
+    '''
+    dfy = gpd.read_file(geo)
+    dfy.to_crs(epsg=4547, inplace=True)
+    return uc.read_file(pois, dfy), dfy
+
+def run_reference(df, dfy, params, timings, kde=None):
+    '''
+    Goals: 以原有函数逐步计算，作为基准结果
+    Args:
+        df[geodataframe]: 重分类后的POI数据
+        dfy[geodataframe]: 投影坐标的分析范围
+        params[dict]: 分析参数
+        timings[dict]: 记录各步骤耗时
+        kde[dict]: 可选参数，传入kde_cells的参数时以kde_center识别中心，网格结果表增加density字段
+    Returns:
+        cells[dataframe]: 各网格的指数及显著度结果表
+        final_result[geodataframe]: 最终结果表
+    '''
+    start = time.perf_counter()
+    netfish = uc.create_grid(dfy, params['cellsize'])
+    dfo = gpd.sjoin(netfish, df, op='contains')
+    result = uc.calc_index(dfo)
+    timings['calc_index'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dfo_join = dfo.drop_duplicates(subset=['index','geometry'], keep='first')
+    df_result = pd.merge(result, dfo_join[['index', 'geometry']], on='index', how='inner')
+    if kde is None:
+        center_result, polygons = uc.explore_center(df_result, params['geo_relation'], params['p_value'], params['threshold'])
+        timings['explore_center'] = time.perf_counter() - start
+    else:
+        lng, lat = uc.grid_axes(dfy, params['cellsize'])
+        center_result, polygons = uc.kde_center(df_result, lng, lat, params['cellsize'], params['threshold'], **kde)
+        timings['kde_center'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    final_result, entropy = uc.func_decider(dfo, center_result, polygons, params['func_threshold'])
+    timings['func_decider'] = time.perf_counter() - start
+    return df_result.drop(columns=['geometry']), final_result
+
+def run_tiled(df, dfy, params, tile_cells=64, kde=None):
+    '''分块并行计算引擎，传入kde时以分块核密度识别中心'''
+    final_result, entropy, cells = uc.tiled_analysis(df, dfy, params['cellsize'], params['geo_relation'], params['p_value'],
+                                                     params['threshold'], params['func_threshold'], tile_cells=tile_cells, workers=4, kde=kde)
+    return cells, final_result
+
+def run_sampled(df, dfy, params):
+    '''快速预览的重抽样计算，抽样比例为1；小类编码中空出一个小类，与重抽样中缺失仅有单个POI的小类的情形一致'''
+    lng, lat = uc.grid_axes(dfy, params['cellsize'])
+    row, col = uc.bin_points(df.geometry.x.values, df.geometry.y.values, lng, lat)
+    keep = row >= 0
+    index = row[keep].astype(np.int64)*(len(lng)-1) + col[keep]
+    cls = pd.factorize(df['小类'].values[keep])[0] + 1 #编码0为重抽样中缺失的小类
+    mid = pd.Categorical(df['中类'].values[keep], categories=uc.MID_CLASSES).codes
+    center, cells = uc.sample_centers(index, cls, mid, lng, lat, params['geo_relation'], params['p_value'], 1.0)
+    center_result, polygons = uc.build_centers(center, cells, lng, lat)
+    center_result = uc.rank_center(center_result, params['threshold'], cells['id'].sum())
+    entropy = uc.grid_entropy(center, cells, polygons)
+    return cells, uc.decide_function(center_result, entropy, params['func_threshold'])
+
+#参与校验的替代引擎，返回(网格结果表或None, 最终结果表)
+ENGINES = {**{'tiled-'+str(size): partial(run_tiled, tile_cells=size) for size in TILE_SIZES},
+           **{'tiled-kde-'+str(size): partial(run_tiled, tile_cells=size, kde=KDE_PARAMS) for size in TILE_SIZES},
+           'sampled': run_sampled}
+
+#以核密度识别中心的引擎，与同一网格表上kde_center的基准结果对比
+KDE_ENGINES = {'tiled-kde-'+str(size) for size in TILE_SIZES}
+
+#重分类的替代实现，输入为分析范围内的原始POI数据，输出与process_poi一致
+RECLASSIFY_ENGINES = {}
+
+def compare_cells(reference, cells):
+    '''
+    Goals: 按网格编号对比网格指数及显著度，引擎结果不含的字段不参与对比
+    Returns:
+        checks[list]: 各字段的(检查项, 最大误差, 容差)
+    '''
+    merged = pd.merge(reference, cells, on='index', how='outer', suffixes=('', '_engine'), indicator=True)
+    checks = [('网格数量', float((merged['_merge'] != 'both').sum()), 0)]
+    for column in [column for column in ['id','De*','Di*','CI','Z','P','density'] if column in cells and column in reference]:
+        expected = merged[column].astype(float).values
+        actual = merged[column+'_engine'].astype(float).values
+        diff = np.abs(expected - actual)
+        diff[np.isnan(expected) & np.isnan(actual)] = 0 #孤立网格的Z、P均为nan
+        checks.append((column, float(np.nan_to_num(diff, nan=np.inf).max()) if len(diff) else 0.0, TOLERANCES[column]))
+    return checks
+
+def compare_centers(reference, final_result):
+    '''
+    Goals: 按中心范围匹配两组中心，对比中心范围、面积、POI数量、等级、功能及区位熵
+    Returns:
+        checks[list]: 各项的(检查项, 最大误差或不一致数量, 容差)
+    '''
+    checks = [('中心数量', float(abs(len(reference) - len(final_result))), 0)]
+    #中心范围在拓扑上相等的视为同一中心
+    matched = []
+    for i, polygon in enumerate(reference.geometry):
+        same = np.nonzero(final_result.geometry.geom_equals(polygon).values)[0]
+        if len(same):
+            matched.append((i, same[0]))
+    checks.append(('中心范围', float(len(reference) - len(matched)), 0))
+    if matched:
+        a = reference.iloc[[i for i, _ in matched]].reset_index(drop=True)
+        b = final_result.iloc[[j for _, j in matched]].reset_index(drop=True)
+        for column in ['area','num_poi','LQ']:
+            checks.append((column, float(np.abs(a[column].astype(float) - b[column].astype(float)).max()), TOLERANCES[column]))
+        for column in ['level','function']:
+            checks.append((column, float((a[column].values != b[column].values).sum()), 0))
+    return checks
+
+def check_reclassify(df):
+    '''
+    Goals: 对比重分类的替代实现，按POI编号对比大类、中类、小类
+    Returns:
+        reference[geodataframe]: 基准的重分类结果，用于后续引擎校验
+        rows[list]: 校验结果
+    '''
+    rows = []
+    start = time.perf_counter()
+    reference = uc.process_poi(df.copy())
+    elapsed = time.perf_counter() - start
+    for name, engine in RECLASSIFY_ENGINES.items():
+        start = time.perf_counter()
+        result = engine(df.copy())
+        engine_elapsed = time.perf_counter() - start
+        merged = pd.merge(reference[['id','大类','中类','小类']], result[['id','大类','中类','小类']], on='id', how='outer', suffixes=('', '_engine'))
+        for column in ['大类','中类','小类']:
+            diff = float((merged[column].fillna('') != merged[column+'_engine'].fillna('')).sum())
+            rows.append({'engine': name, 'stage': 'reclassify', 'check': column, 'diff': diff, 'tolerance': 0,
+                         'passed': diff <= 0, 'speedup': elapsed/engine_elapsed})
+    return reference, rows
+
+def check_engines(df, dfy, params, engines):
+    '''
+    Goals: 对比各替代引擎与基准结果，并统计加速比；核密度引擎与kde_center的基准结果对比
+    Args:
+        df[geodataframe]: 重分类后的POI数据
+        dfy[geodataframe]: 投影坐标的分析范围
+        params[dict]: 分析参数
+        engines[list]: 参与校验的引擎名称
+    Returns:
+        rows[list]: 校验结果
+    '''
+    references, rows = {}, []
+    for name in engines:
+        kde = KDE_PARAMS if name in KDE_ENGINES else None
+        label = 'reference' if kde is None else 'reference-kde'
+        if label not in references:
+            timings = {}
+            references[label] = (*run_reference(df, dfy, params, timings, kde), sum(timings.values()))
+            rows += [{'engine': label, 'stage': stage, 'check': '耗时', 'diff': None, 'tolerance': None,
+                      'passed': True, 'seconds': seconds} for stage, seconds in timings.items()]
+        reference_cells, reference, elapsed = references[label]
+        start = time.perf_counter()
+        cells, final_result = ENGINES[name](df, dfy, params)
+        engine_elapsed = time.perf_counter() - start
+        checks = [] if cells is None else [('cells', *check) for check in compare_cells(reference_cells, cells)]
+        checks += [('centers', *check) for check in compare_centers(reference, final_result)]
+        for stage, check, diff, tolerance in checks:
+            rows.append({'engine': name, 'stage': stage, 'check': check, 'diff': diff, 'tolerance': tolerance, 'passed': diff <= tolerance})
+        rows.append({'engine': name, 'stage': 'all', 'check': '耗时', 'diff': None, 'tolerance': None, 'passed': True,
+                     'seconds': engine_elapsed, 'speedup': elapsed/engine_elapsed})
+    return rows
+
+def make_snapshots(df, seed=0):
+    '''
+    Goals: 由同一组POI生成小类构成不同的多个时相
+    Returns:
+        snapshots[dict]: 时相名称及对应的POI数据，后一时相去除部分小类并随机抽取70%的POI
+    '''
+    rng = np.random.default_rng(seed)
+    classes = df['小类'].unique()
+    later = df[~df['小类'].isin(classes[::4])]
+    later = later[rng.random(len(later)) < 0.7]
+    return {'0': df, '1': later}
+
+def check_temporal(df, dfy, params):
+    '''
+    Goals: 对多个时相运行时序对比引擎，各时相分别与基准结果对比，并统计加速比
+    Args:
+        df[geodataframe]: 重分类后的POI数据
+        dfy[geodataframe]: 投影坐标的分析范围
+        params[dict]: 分析参数
+    Returns:
+        rows[list]: 校验结果
+    '''
+    snapshots = make_snapshots(df)
+    start = time.perf_counter()
+    results, changes = uc.temporal_analysis(snapshots, dfy, params['cellsize'], params['geo_relation'], params['p_value'],
+                                            params['threshold'], params['func_threshold'])
+    engine_elapsed = time.perf_counter() - start
+    rows, elapsed = [], 0
+    for label, snapshot in snapshots.items():
+        timings = {}
+        _, reference = run_reference(snapshot, dfy, params, timings)
+        elapsed += sum(timings.values())
+        final_result = results[results['snapshot'] == label].drop(columns=['snapshot']).reset_index(drop=True)
+        for check, diff, tolerance in compare_centers(reference, final_result):
+            rows.append({'engine': 'temporal', 'stage': 'centers-'+label, 'check': check, 'diff': diff, 'tolerance': tolerance, 'passed': diff <= tolerance})
+    rows.append({'engine': 'temporal', 'stage': 'all', 'check': '耗时', 'diff': None, 'tolerance': None, 'passed': True,
+                 'seconds': engine_elapsed, 'speedup': elapsed/engine_elapsed})
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='中心分析引擎一致性校验')
+    parser.add_argument('--geo', help='实际数据的分析范围geojson')
+    parser.add_argument('--poi', nargs='*', default=[], help='实际数据的POI文件')
+    parser.add_argument('--size', type=int, default=20000, help='生成数据的POI数量')
+    parser.add_argument('--seeds', type=int, default=2, help='生成数据的组数')
+    parser.add_argument('--cellsize', type=int, default=500, help='网格大小')
+    parser.add_argument('--engines', nargs='*', default=list(ENGINES)+['temporal'], help='参与校验的引擎，temporal为多时相的时序对比引擎')
+    args = parser.parse_args()
+
+    #生成数据及实际数据
+    inputs = []
+    for seed in range(args.seeds):
+        raw, dfy = generate_input(args.size, seed)
+        dfy = dfy.to_crs(epsg=4547)
+        inputs.append(('generated-'+str(seed), uc.poi_intersect(raw, dfy), dfy))
+    if args.geo and args.poi:
+        df, dfy = load_input(args.geo, args.poi)
+        inputs.append(('recorded', df, dfy))
+
+    rows = []
+    for label, df, dfy in inputs:
+        df, reclassify_rows = check_reclassify(df)
+        rows += [{'input': label, 'geo_relation': None, **row} for row in reclassify_rows]
+        for geo_relation in ['Queen','Rook']:
+            params = {'cellsize': args.cellsize, 'geo_relation': geo_relation, 'p_value': 0.01, 'threshold': 0.006, 'func_threshold': 1.3}
+            engines = [name for name in args.engines if name in ENGINES]
+            rows += [{'input': label, 'geo_relation': geo_relation, **row} for row in check_engines(df, dfy, params, engines)]
+            if 'temporal' in args.engines:
+                rows += [{'input': label, 'geo_relation': geo_relation, **row} for row in check_temporal(df, dfy, params)]
+
+    report = pd.DataFrame(rows)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(report.to_string(index=False))
+    failed = report[~report['passed']]
+    print('\n校验'+('未通过：'+str(len(failed))+'项' if len(failed) else '通过'))
+    return 1 if len(failed) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
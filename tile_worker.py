@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+分块并行计算的子进程函数
+ProcessPoolExecutor按模块名及函数名传递任务函数，Streamlit将urban_center.py作为__main__运行，
+spawn方式启动的子进程(Windows、macOS的默认方式)无法从__main__中找到这些函数，因此单独放在可导入的模块中
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage, signal, stats
+from numpy import log as ln
+
+MID_CLASSES = ['居住生活功能','工业生产功能','餐饮服务功能','购物服务功能','生活服务功能','住宿服务功能','休闲娱乐功能','行政管理功能','医疗健康功能','文化教育功能','游憩功能']
+
+def cell_counts(index, cls, mid, n_cls):
+    '''
+    Goals: 统计每个网格的POI数量、小类构成及各中类的POI数量
+    Args: 
+        index[ndarray]: 各POI所在的网格编号
+        cls[ndarray]: 各POI的小类编码
+        mid[ndarray]: 各POI的中类编码，对应MID_CLASSES，无中类的POI为-1，仅计入POI数量
+        n_cls[int]: 小类总数
+    Returns:
+        cells[dataframe]: 各网格的POI数量id、小类数量m、小类构成的Σp·ln(p)值H及各中类的POI数量
+    '''
+    pairs, count = np.unique(index.astype(np.int64)*n_cls + cls, return_counts=True)
+    cell, inverse, m = np.unique(pairs//n_cls, return_inverse=True, return_counts=True)
+    n = np.bincount(inverse, weights=count)
+    p = count/n[inverse]
+    cells = pd.DataFrame({'index': cell, 'id': n.astype(np.int64), 'm': m, 'H': np.bincount(inverse, weights=p*ln(p))})
+    valid = mid >= 0
+    mids = np.bincount(np.searchsorted(cell, index[valid])*len(MID_CLASSES) + mid[valid], minlength=len(cell)*len(MID_CLASSES))
+    cells[MID_CLASSES] = mids.reshape(len(cell), len(MID_CLASSES))
+    return cells
+
+def neighbor_sum(values, geo_relation):
+    '''
+    Goals: 对规则网格求邻接网格之和
+    Args: 
+        values[ndarray]: 网格值，形状为(行, 列)
+        geo_relation[str]: 空间关系: [Queen, Rook]
+    Returns: ndarray
+    '''
+    if geo_relation == 'Queen':
+        offsets = [(-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1)]
+    elif geo_relation == 'Rook':
+        offsets = [(-1,0),(0,-1),(0,1),(1,0)]
+    h, w = values.shape
+    padded = np.pad(values, 1)
+    total = np.zeros(values.shape)
+    for dr, dc in offsets:
+        total += padded[1+dr:1+dr+h, 1+dc:1+dc+w]
+    return total
+
+def local_g(values, mask, geo_relation, moments=None):
+    '''
+    Goals: 在规则网格上计算局部G统计量(二值权重，不含自身)，与G_Local的Zs、p_norm一致
+    Args: 
+        values[ndarray]: 网格值，形状为(行, 列)
+        mask[ndarray]: 参与计算的网格，即有POI的网格
+        geo_relation[str]: 空间关系: [Queen, Rook]
+        moments[tuple]: 可选参数，全局的(网格数, 值之和, 值平方和)，分块计算时传入；默认由values计算
+    Returns:
+        z[ndarray]: Z值，不参与计算的网格为nan
+        p[ndarray]: 正态近似的单侧p值
+    '''
+    y = np.where(mask, values, 0.0)
+    if moments is None:
+        moments = (mask.sum(), y.sum(), (y**2).sum())
+    n, y_sum, y2_sum = moments
+    lag = neighbor_sum(y, geo_relation)
+    cardinality = neighbor_sum(mask.astype(float), geo_relation)
+    N = n - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        statistic = lag/(y_sum - y)
+        empirical_mean = (y_sum - y)/N
+        empirical_variance = (y2_sum - y**2)/N - empirical_mean**2
+        expected_value = cardinality/N
+        expected_variance = cardinality*(N - cardinality)/(N - 1)*(1/N**2)*(empirical_variance/empirical_mean**2)
+        z = (statistic - expected_value)/np.sqrt(expected_variance)
+    z = np.where(mask, z, np.nan)
+    return z, stats.norm.sf(np.abs(z))
+
+def tile_hotspot(index, ci, window, core, ncol, geo_relation, moments, p_value):
+    '''
+    Goals: 计算分块内各网格的局部G统计量，并标记分块内连片的中心网格
+    Args: 
+        index, ci[ndarray]: 分块及其缓冲网格的编号、中心性指数
+        window[tuple]: 分块连同缓冲网格的范围(起始行, 起始列, 行数, 列数)
+        core[tuple]: 分块本身的范围(起始行, 起始列, 行数, 列数)
+        ncol[int]: 渔网列数
+        moments[tuple]: 全局的(网格数, 指数之和, 指数平方和)
+    Returns:
+        hotspot[dataframe]: 分块内各网格的Z、P值
+        center[dataframe]: 分块内的中心网格及其分块内的连片编号label
+    '''
+    row, col = np.divmod(index, ncol)
+    row, col = row - window[0], col - window[1]
+    values = np.zeros(window[2:])
+    mask = np.zeros(window[2:], dtype=bool)
+    values[row, col] = ci
+    mask[row, col] = True
+    z, p = local_g(values, mask, geo_relation, moments)
+    p = p/2
+    
+    #仅保留分块本身的网格，缓冲网格由相邻分块负责
+    top, left = core[0]-window[0], core[1]-window[1]
+    inside = (row >= top) & (row < top+core[2]) & (col >= left) & (col < left+core[3])
+    hotspot = pd.DataFrame({'index': index[inside], 'Z': z[row[inside], col[inside]], 'P': p[row[inside], col[inside]]})
+    
+    #共边相连的中心网格为同一中心，与合并后炸开的结果一致
+    area_type = mask & (z > 0) & (p < p_value)
+    labels, _ = ndimage.label(area_type[top:top+core[2], left:left+core[3]])
+    lr, lc = np.nonzero(labels)
+    center = pd.DataFrame({'index': (lr+core[0])*ncol + lc+core[1], 'label': labels[lr, lc]})
+    return hotspot, center
+
+def tile_kde(index, values, window, core, ncol, weights, cut=None):
+    '''
+    Goals: 计算分块内的核密度，缓冲网格圈数不小于核函数半径时与整体计算一致
+    Args: 
+        index, values[ndarray]: 分块及其缓冲范围内有POI网格的编号、栅格化指标
+        window[tuple]: 分块连同缓冲网格的范围(起始行, 起始列, 行数, 列数)
+        core[tuple]: 分块本身的范围(起始行, 起始列, 行数, 列数)
+        weights[ndarray]: kde_kernel得到的核函数权重
+        cut[float]: 可选参数，中心区的核密度阈值
+    Returns:
+        未传入cut时: density[dataframe]: 分块内有POI网格的核密度
+        传入cut时: center[dataframe]: 分块内的中心网格及其分块内的连片编号label
+    '''
+    row, col = np.divmod(index, ncol)
+    row, col = row - window[0], col - window[1]
+    raster = np.zeros(window[2:])
+    raster[row, col] = values
+    top, left = core[0]-window[0], core[1]-window[1]
+    density = np.clip(signal.fftconvolve(raster, weights, mode='same'), 0, None)[top:top+core[2], left:left+core[3]]
+    if cut is None:
+        inside = (row >= top) & (row < top+core[2]) & (col >= left) & (col < left+core[3])
+        return pd.DataFrame({'index': index[inside], 'density': density[row[inside]-top, col[inside]-left]})
+    labels, _ = ndimage.label((density >= cut) & (density > 0))
+    lr, lc = np.nonzero(labels)
+    return pd.DataFrame({'index': (lr+core[0])*ncol + lc+core[1], 'label': labels[lr, lc]})
@@ -8,17 +8,53 @@ Last Edit 8/12/2022
 import requests
 import streamlit as st
 import streamlit_authenticator as stauth
+import plotly
 import plotly.express as px
+import plotly.io as pio
 import pandas as pd
 import geopandas as gpd
 import libpysal
+import numpy as np
+import shapely
+import pyarrow as pa
+import pyarrow.parquet as pq
 import json
 import yaml
 import io
+import os
+import re
+import gzip
+import shutil
+import tempfile
+import zipfile
+import hashlib
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from datetime import datetime
 from yaml.loader import SafeLoader
 from shapely.geometry import Polygon
+from scipy import ndimage, signal, sparse
+from scipy.sparse.csgraph import connected_components
+from tile_worker import MID_CLASSES, cell_counts, neighbor_sum, local_g, tile_hotspot, tile_kde
+from kaleido.scopes.plotly import PlotlyScope
 from numpy import log as ln
 from pysal.explore.esda import G_Local
+try:
+    import zstandard
+except ImportError: #可选依赖，未安装时不提供zstd压缩
+    zstandard = None
+
+EXPORT_FORMATS = {'CSV': 'csv', 'GeoPackage': 'gpkg', 'Parquet': 'parquet'}
+EXPORT_COMPRESSIONS = ['无', 'gzip'] + (['zstd'] if zstandard else [])
+EXPORT_CHUNKSIZE = 50000 #分块写出的行数
+SAMPLE_CHUNKSIZE = 500000 #快速预览时分块读取并抽样的行数
+KDE_KERNELS = ['高斯','Epanechnikov','四次']
+RENDER_BASEMAPS = ['white-bg','carto-positron','carto-darkmatter','open-street-map','stamen-terrain','stamen-toner','stamen-watercolor']
+RENDER_FORMATS = ['png','svg','pdf']
+RENDER_CACHE_SIZE = 256*1024*1024 #图片缓存的总字节数上限，超出后淘汰最久未使用的图片
+RENDER_FONT = 'Noto Sans CJK SC' #服务器端渲染使用的中文字体，见packages.txt
 
 def main():    
     st.sidebar.title("导航")
@@ -48,7 +84,7 @@ def urban_center_analysis():
     #数据输入
     st.header("蕾奥城市中心体系分析软件V1.0")
     st.caption("基于POI数据的城市中心范围、等级、功能识别")
-    mode = st.radio("选择运行模式", ["中心分析", "可视化"], help='中心分析包括从数据输入到导出结果文件的全过程，可视化指上传生成的结果文件进行可视化')
+    mode = st.radio("选择运行模式", ["中心分析", "可视化", "时序对比"], help='中心分析包括从数据输入到导出结果文件的全过程，可视化指上传生成的结果文件进行可视化，时序对比指在同一网格上对比多个时相POI数据的中心变化')
     
     if mode == '中心分析':
         with st.form(key='urban_center_analysis'):
@@ -58,11 +94,46 @@ def urban_center_analysis():
 
             #参数设置
             cellsize = st.number_input("网格大小", min_value=50, max_value=1000, value=500, help="根据分析范围划分网格，默认值为500米")
-            geo_relation = st.radio("空间邻接算法", ["Queen", "Rook"], help='Queen为共顶点和共边邻接，Rook为共边邻接')      
+            method = st.radio("中心识别方法", ["热点分析", "核密度"], help='热点分析基于局部G统计量识别显著的高值聚集区，核密度基于平滑后的指标分布识别高值连片区')
+            geo_relation = st.radio("空间邻接算法", ["Queen", "Rook"], help='Queen为共顶点和共边邻接，Rook为共边邻接；仅用于热点分析')      
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                kernel = st.selectbox("核函数", options=KDE_KERNELS, help="仅用于核密度")
+            with col2:
+                bandwidth = st.number_input("带宽", min_value=100, max_value=10000, value=1000, help="核密度的搜索半径，单位：米，默认值1000米")
+            with col3:
+                kde_weight = st.selectbox("核密度指标", options=['CI','POI数量'], help="栅格化后进行平滑的网格指标")
+            with col4:
+                quantile = st.number_input("核密度分位数", min_value=0.5, max_value=0.99, value=0.9, help="核密度高于有POI网格该分位数的区域为中心区，默认值0.9")
             p_value = st.number_input("显著性水平", min_value=0.01, max_value=0.05, value=0.01, help="用于确定热点区范围，默认值0.01")
             threshold = st.text_input("去噪阈值", value='0.006', help="用于去除POI总数较少的噪点，默认值0.006")
             func_threshold = st.number_input("区位熵阈值", min_value=1.15, max_value=1.5, value=1.3, help="用于判断是否为综合功能中心，默认值1.3")
             
+            #分块计算设置
+            tiled = st.checkbox("分块并行计算", value=False, help="将分析范围划分为若干分块并行计算，适用于省域等大范围、小网格的分析，结果与常规计算一致")
+            col1, col2 = st.columns(2)
+            with col1:
+                tile_cells = st.number_input("分块大小", min_value=16, max_value=2048, value=256, help="每个分块的边长，单位：网格数，默认值256")
+            with col2:
+                workers = st.number_input("并行进程数", min_value=1, max_value=32, value=4, help="分块计算的进程数量，默认值4")
+            
+            #导出设置
+            col1, col2 = st.columns(2)
+            with col1:
+                export_format = st.selectbox("导出格式", options=list(EXPORT_FORMATS), help="结果文件格式，CSV中的几何以WKT文本存储")
+            with col2:
+                export_compression = st.selectbox("导出压缩", options=EXPORT_COMPRESSIONS, help="对导出文件进行压缩，Parquet格式使用其内部压缩编码")
+            export_cells = st.checkbox("导出网格结果", value=False, help="同时导出各网格的指数及显著度结果，网格较细时文件较大")
+            
+            #快速预览设置
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                quick = st.checkbox("快速预览", value=False, help="按类别及空间分层抽样POI进行计算，并以bootstrap估计中心等级、功能的稳定性，用于在完整分析前快速调整参数")
+            with col2:
+                fraction = st.number_input("抽样比例", min_value=0.01, max_value=0.5, value=0.05, help="快速预览的POI抽样比例，默认值0.05")
+            with col3:
+                replicates = st.number_input("重抽样次数", min_value=0, max_value=200, value=20, help="bootstrap重抽样次数，为0时不估计稳定性，默认值20")
+            
             preview = st.checkbox("数据预览", value=False, key='urban_center_analysis')
             run = st.form_submit_button(label='运行')
             
@@ -70,10 +141,11 @@ def urban_center_analysis():
             with st.spinner("正在读取数据..."):
                 dfy = gpd.read_file(geo) #输入范围
                 dfy.to_crs(epsg=4547, inplace=True) #转投影坐标
-                netfish = create_grid(dfy, cellsize) #根据输入范围创建网格
+                if not (tiled or quick):
+                    netfish = create_grid(dfy, cellsize) #根据输入范围创建网格
                 
-                #读取合并所有类别数据
-                df = read_file(pois, dfy)
+                #读取合并所有类别数据，快速预览时分层抽样
+                df = read_file(pois, dfy, fraction if quick else None, cellsize)
                 del pois
             st.success('数据读取完成！')
 
@@ -81,58 +153,177 @@ def urban_center_analysis():
                 st.write(df.head())
     
             with st.spinner("正在处理POI数据..."):
-                df.dropna(subset=['name'], axis=0, how='any', inplace=True) #检查名称是否为空
-                df.drop_duplicates(subset=['name','address'], keep='first', inplace=True) #按名称+地址去重
-                df[['一级分类','二级分类','三级分类']] = df['type'].str.split(';', expand=True, n=2) #增加类别字段                
-                df.drop(columns=['address','type'], inplace=True)
-                df = reclassify(df) #重分类
-            st.success('数据处理完成！共有'+str(len(df))+'条POI数据')
+                df = process_poi(df)
+            st.success('数据处理完成！共有'+str(len(df))+'条POI数据'+('(抽样)' if quick else ''))
+            
+            weight = 'CI' if kde_weight == 'CI' else 'id'
+            kde = {'weight': weight, 'kernel': kernel, 'bandwidth': bandwidth, 'quantile': quantile} if method == '核密度' else None
+            if quick:
+                with st.spinner("正在计算预览结果..."):
+                    start = datetime.now()
+                    final_result = preview_analysis(df, dfy, cellsize, geo_relation, p_value, float(threshold), func_threshold, fraction, replicates, kde)
+                    del df
+                st.success('预览完成！用时'+str(round((datetime.now()-start).total_seconds(), 1))+'秒，POI数量已按抽样比例折算，确认参数后取消快速预览以运行完整分析')
+                st.dataframe(pd.DataFrame(final_result.drop(columns='geometry')))
+                st.session_state['urban_center_result'] = (final_result, dfy)
+                show_plot(final_result, dfy)
+                return
     
             with st.spinner("正在进行空间计算..."):
-                #渔网空间相交
-                dfo = gpd.sjoin(netfish, df, op='contains') #POI数据与渔网空间相交              
-                #指数计算
-                result = calc_index(dfo)
-                #指数结果合并geometry
-                dfo_join = dfo.drop_duplicates(subset=['index','geometry'], keep='first')
-                df_result = pd.merge(result, dfo_join[['index', 'geometry']], on='index', how='inner')
-                del dfo_join
-                del result
-                #中心相关计算
-                center_result, polygons = explore_center(df_result, geo_relation, p_value, float(threshold))
-                #合并功能得到最终结果
-                final_result, entropy = func_decider(dfo, center_result, polygons, func_threshold)
-                del dfo
-                del df_result
-                del center_result
+                if tiled:
+                    #分块并行计算，不生成完整渔网
+                    final_result, entropy, df_result = tiled_analysis(df, dfy, cellsize, geo_relation, p_value, float(threshold), func_threshold, tile_cells, workers, kde)
+                    del df
+                    if export_cells:
+                        df_result = gpd.GeoDataFrame(df_result[['index','id','De','De*','m','Di','Di*','CI']+(['density'] if kde else ['Z','P'])],
+                                                     geometry=cell_polygons(df_result['index'].values, *grid_axes(dfy, cellsize)).values, crs='EPSG:4547')
+                    else:
+                        del df_result
+                else:
+                    #渔网空间相交
+                    dfo = gpd.sjoin(netfish, df, op='contains') #POI数据与渔网空间相交              
+                    #指数计算
+                    result = calc_index(dfo)
+                    #指数结果合并geometry
+                    dfo_join = dfo.drop_duplicates(subset=['index','geometry'], keep='first')
+                    df_result = pd.merge(result, dfo_join[['index', 'geometry']], on='index', how='inner')
+                    del dfo_join
+                    del result
+                    #中心相关计算
+                    if method == '热点分析':
+                        center_result, polygons = explore_center(df_result, geo_relation, p_value, float(threshold))
+                    elif method == '核密度':
+                        lng, lat = grid_axes(dfy, cellsize)
+                        center_result, polygons = kde_center(df_result, lng, lat, cellsize, float(threshold), weight, kernel, bandwidth, quantile)
+                    #合并功能得到最终结果
+                    final_result, entropy = func_decider(dfo, center_result, polygons, func_threshold)
+                    del dfo
+                    del center_result
+                    if export_cells:
+                        df_result = gpd.GeoDataFrame(df_result, geometry='geometry', crs='EPSG:4547')
+                    else:
+                        del df_result
             st.success('运行成功！')    
             #导出结果
             name = parse_path(geo.name)
-            csv = convert_df(final_result)
-            st.download_button(
-                 label="下载结果文件",
-                 data=csv,
-                 file_name='中心分析结果_'+name+'.csv',
-                 mime='csv',
-            )
+            meta = {'name': name, 'cellsize': cellsize, 'geo_relation': geo_relation, 'p_value': p_value,
+                    'threshold': float(threshold), 'func_threshold': func_threshold, 'tiled': tiled, 'method': method,
+                    'created': datetime.now().isoformat(timespec='seconds')}
+            if kde is not None:
+                meta.update({'kernel': kernel, 'bandwidth': bandwidth, 'kde_weight': kde_weight, 'quantile': quantile})
+            if tiled:
+                meta.update({'tile_cells': tile_cells, 'workers': workers})
+            compression = None if export_compression == '无' else export_compression
+            with st.spinner("正在导出结果..."):
+                result_file, suffix = export_df(final_result, export_format, compression)
+                package_file = convert_package(final_result, entropy, meta)
+                if export_cells:
+                    cell_file, cell_suffix = export_df(df_result, export_format, compression)
+                    del df_result
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.download_button(
+                     label="下载结果文件",
+                     data=result_file,
+                     file_name='中心分析结果_'+name+'.'+suffix,
+                     mime='application/octet-stream',
+                )
+            with col2:
+                st.download_button(
+                     label="下载结果包(GeoParquet)",
+                     data=package_file,
+                     file_name='中心分析结果_'+name+'.zip',
+                     mime='application/zip',
+                     help='二进制结果包，包含结果表、区位熵表及运行参数，可视化模式下读取更快'
+                )
+            if export_cells:
+                with col3:
+                    st.download_button(
+                         label="下载网格结果",
+                         data=cell_file,
+                         file_name='网格分析结果_'+name+'.'+cell_suffix,
+                         mime='application/octet-stream',
+                    )
+            st.session_state['urban_center_result'] = (final_result, dfy)
             show_plot(final_result, dfy)            
+        elif 'urban_center_result' in st.session_state:
+            #应用可视化设置及导出图片时脚本会重新运行，沿用本次会话上一次的分析结果
+            st.caption('当前显示上一次的分析结果')
+            show_plot(*st.session_state['urban_center_result'])
             
     elif mode == '可视化':
-        data = st.file_uploader("上传分析结果", type='csv', key='plot1')
+        data = st.file_uploader("上传分析结果", type=['csv','gpkg','parquet','zip','gz']+(['zst'] if zstandard else []), key='plot1', help='支持导出的CSV、GeoPackage、Parquet结果文件(含压缩文件)及GeoParquet结果包')
         geo = st.file_uploader("上传范围", type='geojson', key='plot2')
         
         if data and geo: 
-            df = pd.read_csv(data, encoding = "UTF-8")
+            df, entropy, meta = load_result(data.getvalue(), data.name)
+            if meta:
+                with st.expander("运行参数"):
+                    st.json(meta)
+            if entropy is not None:
+                with st.expander("区位熵结果"):
+                    st.dataframe(entropy)
             dfy = gpd.read_file(geo) #输入范围
             dfy.to_crs(epsg=4547, inplace=True) #转投影坐标
-            show_plot(df, dfy, 1)
+            show_plot(df, dfy)
 
-def show_plot(final_result, dfy, signal=0):
+    elif mode == '时序对比':
+        with st.form(key='temporal_analysis'):
+            geo = st.file_uploader("上传范围", type='geojson', key='t1')
+            pois = st.file_uploader("上传各时相POI数据", type='csv', key='t2', accept_multiple_files=True, help='按文件名中的年份划分时相，如POI_2019_餐饮.csv，同一年份的多个文件合并为一个时相；文件名不含年份的单独作为一个时相')
+            cellsize = st.number_input("网格大小", min_value=50, max_value=1000, value=500, help="根据分析范围划分网格，默认值为500米")
+            geo_relation = st.radio("空间邻接算法", ["Queen", "Rook"], help='Queen为共顶点和共边邻接，Rook为共边邻接')      
+            p_value = st.number_input("显著性水平", min_value=0.01, max_value=0.05, value=0.01, help="用于确定热点区范围，默认值0.01")
+            threshold = st.text_input("去噪阈值", value='0.006', help="用于去除POI总数较少的噪点，默认值0.006")
+            func_threshold = st.number_input("区位熵阈值", min_value=1.15, max_value=1.5, value=1.3, help="用于判断是否为综合功能中心，默认值1.3")
+            run = st.form_submit_button(label='运行')
+        
+        if run:
+            with st.spinner("正在读取数据..."):
+                dfy = gpd.read_file(geo) #输入范围
+                dfy.to_crs(epsg=4547, inplace=True) #转投影坐标
+                groups = {}
+                for poi in pois:
+                    year = re.search(r'(19|20)\d{2}', poi.name)
+                    groups.setdefault(year.group(0) if year else parse_path(poi.name), []).append(poi)
+                snapshots = {label: process_poi(read_file(groups[label], dfy)) for label in sorted(groups)}
+                del pois
+            st.success('数据读取完成！共有'+str(len(snapshots))+'个时相：'+'、'.join(snapshots))
+            
+            with st.spinner("正在进行空间计算..."):
+                results, changes = temporal_analysis(snapshots, dfy, cellsize, geo_relation, p_value, float(threshold), func_threshold)
+                del snapshots
+            st.success('运行成功！')
+            
+            st.subheader('各时相中心')
+            st.dataframe(pd.DataFrame(results.drop(columns='geometry')))
+            st.subheader('中心变化')
+            st.dataframe(changes)
+            
+            name = parse_path(geo.name)
+            result_file, suffix = export_df(results, 'CSV')
+            change_file, change_suffix = export_df(changes, 'CSV')
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button(
+                     label="下载各时相结果",
+                     data=result_file,
+                     file_name='时序中心结果_'+name+'.'+suffix,
+                     mime='csv',
+                )
+            with col2:
+                st.download_button(
+                     label="下载中心变化表",
+                     data=change_file,
+                     file_name='中心变化_'+name+'.'+change_suffix,
+                     mime='csv',
+                )
+
+def show_plot(final_result, dfy):
     """
     Goal: 在线可视化
     Args:
-        final_result: 用于可视化的数据
-        signal: 可选参数，默认为0；如果传入值为1，需要重新处理为geodataframe
+        final_result: 用于可视化的数据，投影坐标的geodataframe
     Returns: None
     """
     st.subheader('可视化参数设置')
@@ -166,11 +357,6 @@ def show_plot(final_result, dfy, signal=0):
         run = st.form_submit_button(label='应用')
     
     if run:
-        #数据重新处理
-        if signal == 1:
-            geometry = gpd.GeoSeries.from_wkt(final_result['geometry'])
-            final_result = gpd.GeoDataFrame(final_result, geometry=geometry, crs=4547)
-            
         #Mapbox Key Match
         if key_option == '默认样式1首选':
             key = 'pk.eyJ1IjoibW9leDEwMDIzNiIsImEiOiJjbDF1ZW1oYmYybXAyM2NvMmczNmRlOXptIn0.HAW1OjKgMO_cBdSWVvMKjg'
@@ -184,91 +370,454 @@ def show_plot(final_result, dfy, signal=0):
 
         #转为WGS84坐标
         dfy.to_crs(epsg=4326,inplace=True)
-        final_result.to_crs(epsg=4326,inplace=True)
+        final_result = final_result.to_crs(epsg=4326) #不修改缓存中的结果
         
-        #设置标题和自定义颜色
+        #设置自定义颜色
         cmap = None
-        labels = {"level": "等级", "function": "功能"}
-        if variable == '等级':
-            title = '中心等级分布图'
-            var = 'level'
-            if custom_color:
-                cmap = {'主中心': color1, '次中心': color2, '组团': color3}
-        elif variable == '功能':
-            title = '中心功能分布图'
-            var = 'function'
+        if variable == '等级' and custom_color:
+            cmap = {'主中心': color1, '次中心': color2, '组团': color3}
              
         #可视化
-        if basemap.__contains__('默认'):
-            fig = px.choropleth_mapbox(final_result,
-                           geojson=final_result.geometry,
-                           locations=final_result.index,
-                           color=var,
-                           color_discrete_map=cmap,
-                           hover_data=['area','num_poi','level','function'],
-                           labels=labels,
-                           center={"lat": 22.6, "lon": 114},
-                           mapbox_style='white-bg',
-                           opacity=alpha,
-                           title=title,
-                           zoom=8.5)
-            fig.update_layout(mapbox={"accesstoken": key, 'style': style,"layers": [
-                    {
-                        "source": json.loads(dfy.geometry.to_json()), #绘制范围
-                        "below": "traces",
-                        "type": "line",
-                        "color": line_color,
-                        "line": {"width": 1.5},
-                    }
-                ]
-            })
-
-        else: 
-            fig = px.choropleth_mapbox(final_result,
-                           geojson=final_result.geometry,
-                           locations=final_result.index,
-                           color=var,
-                           color_discrete_map=cmap,
-                           hover_data=['area','num_poi','level','function'],
-                           labels=labels,
-                           center={"lat": 22.6, "lon": 114},
-                           mapbox_style=basemap,
-                           opacity=alpha,
-                           title=title,
-                           zoom=8.5)
-            fig.update_layout(mapbox={"accesstoken": key, "layers": [
-                    {
-                        "source": json.loads(dfy.geometry.to_json()), #绘制范围
-                        "below": "traces",
-                        "type": "line",
-                        "color": line_color,
-                        "line": {"width": 1.5},
-                    }
-                ]
-            })
-        #buffer = io.BytesIO()
-        #fig.write_image(file=buffer, format="jpg", scale=4)
-        #st.download_button(
-        #    label="下载图片",
-        #    data=buffer,
-        #    file_name="figure.jpg",
-        #    mime="image/jpg",
-        #)
+        fig = build_figure(final_result, dfy, variable, basemap, alpha, line_color, cmap, key, style)
         st.plotly_chart(fig, use_container_width=True)
+    
+    #批量导出静态图片
+    st.subheader('图片导出')
+    with st.form(key='render'):
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            render_basemaps = st.multiselect('底图样式', options=RENDER_BASEMAPS, default=['white-bg'], help='white-bg无需联网，其余样式需在线加载底图瓦片')
+        with col2:
+            render_formats = st.multiselect('图片格式', options=RENDER_FORMATS, default=['png'])
+        with col3:
+            scale = st.number_input("输出倍率", min_value=1, max_value=8, value=4, help="倍率越大分辨率越高")
+        with col4:
+            workers = st.number_input("渲染进程数", min_value=1, max_value=8, value=2, help="并行渲染的kaleido进程数量，进程常驻并在各次导出间复用")
+        render = st.form_submit_button(label='导出')
+    
+    if render and render_basemaps and render_formats:
+        cmap = {'主中心': color1, '次中心': color2, '组团': color3} if custom_color else None
+        with st.spinner("正在渲染图片..."):
+            images = render_maps(final_result, dfy, render_basemaps, render_formats, alpha, line_color, cmap, scale, workers)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as package:
+            for file_name, image in images.items():
+                package.writestr(file_name, image)
+        st.download_button(
+            label="下载图片",
+            data=buffer,
+            file_name="中心分析图片.zip",
+            mime="application/zip",
+        )
+
+def build_figure(final_result, dfy, variable, basemap, alpha, line_color, cmap=None, key=None, style=None, center=None, zoom=8.5):
+    """
+    Goal: 生成中心等级或功能分布图
+    Args:
+        final_result[geodataframe]: WGS84坐标的结果表
+        dfy[geodataframe]: WGS84坐标的分析范围
+        variable[str]: 可视化类型: [等级, 功能]
+        basemap[str]: 底图样式，默认样式需同时传入key及style
+        cmap[dict]: 可选参数，等级的自定义配色
+        center[dict]: 可选参数，地图中心点，默认为深圳
+    Returns: Figure
+    """
+    labels = {"level": "等级", "function": "功能"}
+    if variable == '等级':
+        title = '中心等级分布图'
+        var = 'level'
+    elif variable == '功能':
+        title = '中心功能分布图'
+        var = 'function'
+        cmap = None
+    if center is None:
+        center = {"lat": 22.6, "lon": 114}
+    
+    fig = px.choropleth_mapbox(final_result,
+                   geojson=final_result.geometry,
+                   locations=final_result.index,
+                   color=var,
+                   color_discrete_map=cmap,
+                   hover_data=['area','num_poi','level','function'],
+                   labels=labels,
+                   center=center,
+                   mapbox_style='white-bg' if basemap.__contains__('默认') else basemap,
+                   opacity=alpha,
+                   title=title,
+                   zoom=zoom)
+    mapbox = {"accesstoken": key, "layers": [
+            {
+                "source": json.loads(dfy.geometry.to_json()), #绘制范围
+                "below": "traces",
+                "type": "line",
+                "color": line_color,
+                "line": {"width": 1.5},
+            }
+        ]
+    }
+    if basemap.__contains__('默认'):
+        mapbox['style'] = style
+    fig.update_layout(mapbox=mapbox)
+    return fig
+
+@st.cache(allow_output_mutation=True)
+def render_pool():
+    """
+    Goal: 全局唯一的常驻kaleido渲染进程池，各进程在会话间复用，避免每张图片重新启动渲染进程
+    Returns: Dict，scopes为空闲的渲染进程队列，size为已启动的进程数
+    """
+    pio.to_json({}) #在主线程中完成plotly序列化模块的延迟导入，避免多线程同时导入出错
+    return {'scopes': queue.Queue(), 'size': 0, 'lock': threading.Lock()}
+
+def render_scopes(workers):
+    """
+    Goal: 按需扩充渲染进程池，进程总数不超过各次请求的最大并行数
+    Returns: Queue，空闲的kaleido渲染进程
+    """
+    pool = render_pool()
+    with pool['lock']:
+        while pool['size'] < workers:
+            #使用plotly自带的plotly.js，不从CDN加载，离线可用
+            plotlyjs = os.path.join(os.path.dirname(plotly.__file__), 'package_data', 'plotly.min.js')
+            pool['scopes'].put(PlotlyScope(plotlyjs=plotlyjs, mathjax=False))
+            pool['size'] += 1
+    return pool['scopes']
+
+@st.cache(allow_output_mutation=True)
+def render_cache():
+    """
+    Goal: 已渲染图片的缓存，键为(结果哈希, 底图, 类型, 配色, 格式, 倍率)，总字节数不超过RENDER_CACHE_SIZE
+    Returns: Dict，images为按使用先后排列的图片，size为图片总字节数
+    """
+    return {'images': OrderedDict(), 'size': 0, 'lock': threading.Lock()}
+
+def cached_image(cache, key):
+    """
+    Goal: 读取缓存的图片并标记为最近使用
+    Returns: Bytes，未缓存时为None
+    """
+    with cache['lock']:
+        image = cache['images'].get(key)
+        if image is not None:
+            cache['images'].move_to_end(key)
+        return image
+
+def cache_image(cache, key, image):
+    """
+    Goal: 缓存图片，超出总字节数上限时淘汰最久未使用的图片
+    Returns: None
+    """
+    with cache['lock']:
+        if key in cache['images']:
+            cache['size'] -= len(cache['images'].pop(key))
+        cache['images'][key] = image
+        cache['size'] += len(image)
+        while cache['size'] > RENDER_CACHE_SIZE and len(cache['images']) > 1:
+            cache['size'] -= len(cache['images'].popitem(last=False)[1])
 
-def read_file(pois, dfy):
+def render_image(scopes, fig, fmt, scale):
+    """
+    Goal: 取出一个空闲的渲染进程输出图片，完成后归还
+    Returns: Bytes
+    """
+    scope = scopes.get()
+    try:
+        return scope.transform(fig, format=fmt, scale=scale)
+    finally:
+        scopes.put(scope)
+
+def result_hash(final_result):
+    """
+    Goal: 计算结果表的哈希值，用于图片缓存
+    Returns: String
+    """
+    digest = hashlib.md5()
+    digest.update(pd.util.hash_pandas_object(pd.DataFrame(final_result.drop(columns=final_result.geometry.name)).astype(str), index=True).values.tobytes())
+    for wkb in final_result.geometry.to_wkb():
+        digest.update(wkb)
+    return digest.hexdigest()
+
+def render_maps(final_result, dfy, basemaps, formats, alpha, line_color, cmap=None, scale=4, workers=2):
+    """
+    Goal: 并行渲染等级及功能分布图，按底图样式和格式批量输出静态图片
+    Args:
+        final_result[geodataframe]: 结果表
+        dfy[geodataframe]: 分析范围
+        basemaps[list]: 底图样式，仅支持无需Mapbox Key的样式
+        formats[list]: 图片格式: [png, svg, pdf]
+        cmap[dict]: 可选参数，等级的自定义配色
+        scale[int]: 输出倍率
+        workers[int]: 并行渲染的进程数量
+    Returns:
+        images[dict]: 文件名及对应的图片内容
+    """
+    scopes = None
+    cache = render_cache()
+    digest = result_hash(final_result)
+    colors = tuple(sorted(cmap.items())) if cmap else None
+    
+    #转为WGS84坐标，并根据范围确定地图中心及缩放等级
+    final_result = final_result.to_crs(epsg=4326)
+    dfy = dfy.to_crs(epsg=4326)
+    bounds = dfy.total_bounds
+    center = {"lat": (bounds[1]+bounds[3])/2, "lon": (bounds[0]+bounds[2])/2}
+    zoom = float(np.log2(360/max(bounds[2]-bounds[0], bounds[3]-bounds[1]))) - 0.5
+    
+    images = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for basemap in basemaps:
+            for variable in ['等级','功能']:
+                fig = None
+                for fmt in formats:
+                    file_name = variable+'_'+basemap+'.'+fmt
+                    key = (digest, basemap, variable, colors if variable == '等级' else None, alpha, line_color, fmt, scale)
+                    image = cached_image(cache, key)
+                    if image is not None:
+                        images[file_name] = image
+                        continue
+                    if scopes is None:
+                        scopes = render_scopes(workers)
+                    if fig is None:
+                        fig = build_figure(final_result, dfy, variable, basemap, alpha, line_color, cmap, center=center, zoom=zoom)
+                        fig.update_layout(width=1200, height=900, font_family=RENDER_FONT)
+                    futures[executor.submit(render_image, scopes, fig, fmt, scale)] = (file_name, key)
+        for future in as_completed(futures):
+            file_name, key = futures[future]
+            images[file_name] = future.result()
+            cache_image(cache, key, images[file_name])
+    return images
+
+def process_poi(df):
+    '''
+    Goals: POI数据清洗，去除空名称及重复数据，拆分类别字段后重分类
+    Args: 
+        df[geodataframe]: 读取的POI数据
+    Returns:
+        df[geodataframe]: 重分类后的POI数据
+    '''
+    df.dropna(subset=['name'], axis=0, how='any', inplace=True) #检查名称是否为空
+    df.drop_duplicates(subset=['name','address'], keep='first', inplace=True) #按名称+地址去重
+    df[['一级分类','二级分类','三级分类']] = df['type'].str.split(';', expand=True, n=2) #增加类别字段                
+    df.drop(columns=['address','type'], inplace=True)
+    df = reclassify(df) #重分类
+    return df
+
+def read_file(pois, dfy, fraction=None, cellsize=500):
     frames = []
     for poi in pois:
-        df = pd.read_csv(poi, usecols=['id','name','address','type','wgslng','wgslat'], converters = {'id': str, 'name': str, 'address': str, 'type': str, 'wgslng': float, 'wgslat': float}, encoding='gb18030')
+        if fraction:
+            df = read_sample(poi, fraction, cellsize)
+        else:
+            df = pd.read_csv(poi, usecols=['id','name','address','type','wgslng','wgslat'], converters = {'id': str, 'name': str, 'address': str, 'type': str, 'wgslng': float, 'wgslat': float}, encoding='gb18030')
         #筛选范围内数据
         df = poi_intersect(df, dfy)       
         frames.append(df)
     df_final = pd.concat(frames)
     return df_final         
 
-@st.cache()
-def convert_df(df):
-    return df.to_csv(index=False).encode('UTF-8')
+def read_sample(poi, fraction, cellsize):
+    '''
+    Goals: 快速预览时分块读取POI文件并逐块分层抽样，以dtype代替逐值转换的converters，抽样后再生成几何
+    Args: 
+        poi[file]: POI文件
+        fraction[float]: 抽样比例
+        cellsize[int]: 网格大小，单位：米
+    Returns:
+        df[dataframe]: 抽样后的POI数据，字段与完整读取一致
+    '''
+    columns = ['id','name','address','type']
+    frames = []
+    with pd.read_csv(poi, usecols=columns+['wgslng','wgslat'], dtype={**dict.fromkeys(columns, str), 'wgslng': float, 'wgslat': float},
+                     keep_default_na=False, na_values={'wgslng': [''], 'wgslat': ['']}, encoding='gb18030', chunksize=SAMPLE_CHUNKSIZE) as reader:
+        for seed, chunk in enumerate(reader):
+            frames.append(sample_pois(chunk, fraction, cellsize, seed))
+    return pd.concat(frames)
+
+def sample_pois(df, fraction, cellsize, seed=0):
+    '''
+    Goals: 按POI一级分类及空间位置分层随机抽样，空间分层为约10倍网格大小的经纬度方格
+    Args: 
+        df[dataframe]: 原始POI数据
+        fraction[float]: 抽样比例
+        cellsize[int]: 网格大小，单位：米
+    Returns:
+        df[dataframe]: 抽样后的POI数据
+    '''
+    if df.empty:
+        return df
+    rng = np.random.default_rng(seed)
+    df = df.iloc[rng.permutation(len(df))]
+    block = cellsize*10/111000
+    #只对不重复的分类字符串取一级分类，再与经纬度方格编号合成整数分层键
+    codes, types = pd.factorize(df['type'])
+    major = pd.factorize(types.str.split(';', n=1).str[0])[0]
+    key = major[codes].astype(np.int64)
+    for axis in ('wgslng', 'wgslat'):
+        cell = pd.factorize(df[axis].values//block)[0]
+        key = key*(cell.max()+2) + cell
+    strata = pd.Series(pd.factorize(key)[0])
+    #各层内随机起点等距抽取，小样本层按比例取整而不被舍去
+    k = strata.groupby(strata).cumcount().values
+    start = rng.random(strata.max()+1)[strata.values]
+    keep = np.floor((k+1)*fraction + start) > np.floor(k*fraction + start)
+    return df[keep]
+
+def export_df(df, fmt='CSV', compression=None, chunksize=EXPORT_CHUNKSIZE):
+    """
+    Goal: 分块将结果表写入磁盘临时文件，写出及压缩过程中不生成完整的字符串或未压缩的字节串
+          注意：download_button会将文件整体读入内存，每个导出文件在提供下载时仍有一份完整的字节副本
+    Args:
+        df[dataframe]: 待导出的结果表，导出GeoPackage时须为geodataframe
+        fmt[str]: 导出格式: [CSV, GeoPackage, Parquet]
+        compression[str]: 可选参数，默认不压缩: [None, gzip, zstd]
+        chunksize[int]: 每次写出的行数
+    Returns:
+        file[file]: 可直接用于download_button的文件对象
+        suffix[str]: 文件后缀
+    """
+    file = tempfile.TemporaryFile()
+    suffix = EXPORT_FORMATS[fmt]
+    if fmt == 'Parquet':
+        #Parquet按行组写出，压缩由其内部编码完成
+        write_parquet(df, file, compression, chunksize)
+    else:
+        stream = compress_stream(file, compression)
+        if fmt == 'CSV':
+            for start in range(0, max(len(df), 1), chunksize):
+                chunk = df.iloc[start:start+chunksize].to_csv(index=False, header=(start == 0))
+                stream.write(chunk.encode('UTF-8'))
+        elif fmt == 'GeoPackage':
+            write_gpkg(df, stream, chunksize)
+        if stream is not file:
+            stream.close()
+        if compression == 'gzip':
+            suffix += '.gz'
+        elif compression == 'zstd':
+            suffix += '.zst'
+    return file_reader(file), suffix
+
+def write_parquet(df, file, compression, chunksize):
+    """
+    Goal: 按行组分块写出Parquet，geodataframe的几何以WKB存储并写入GeoParquet元数据
+    Args:
+        df[dataframe]: 待导出的结果表
+        file[file]: 写入的文件对象
+        compression[str]: 压缩编码，None时使用snappy
+        chunksize[int]: 每个行组的行数
+    Returns: None
+    """
+    writer = None
+    for start in range(0, max(len(df), 1), chunksize):
+        chunk = pd.DataFrame(df.iloc[start:start+chunksize])
+        if isinstance(df, gpd.GeoDataFrame):
+            chunk[df.geometry.name] = df.geometry.iloc[start:start+chunksize].to_wkb().values
+        if writer is None:
+            schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+            if isinstance(df, gpd.GeoDataFrame):
+                geo = {'version': '1.0.0', 'primary_column': df.geometry.name,
+                       'columns': {df.geometry.name: {'encoding': 'WKB', 'geometry_types': [],
+                                                      'crs': df.crs.to_json_dict() if df.crs else None}}}
+                schema = schema.with_metadata({**schema.metadata, b'geo': json.dumps(geo).encode('UTF-8')})
+            writer = pq.ParquetWriter(file, schema, compression=compression or 'snappy')
+        writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    writer.close()
+
+def write_gpkg(df, stream, chunksize):
+    """
+    Goal: 分块写出GeoPackage，GeoPackage须写入磁盘文件，完成后复制到输出流
+    Args:
+        df[geodataframe]: 待导出的结果表
+        stream[file]: 输出流
+        chunksize[int]: 每次追加的行数
+    Returns: None
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'result.gpkg')
+        for start in range(0, max(len(df), 1), chunksize):
+            df.iloc[start:start+chunksize].to_file(path, driver='GPKG', mode='w' if start == 0 else 'a')
+        with open(path, 'rb') as gpkg:
+            shutil.copyfileobj(gpkg, stream)
+
+def compress_stream(file, compression):
+    """
+    Goal: 按压缩方式包装输出流
+    Returns: 写入后需关闭的压缩流，不压缩时返回原文件对象
+    """
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=file, mode='wb')
+    elif compression == 'zstd':
+        return zstandard.ZstdCompressor().stream_writer(file, closefd=False)
+    return file
+
+def file_reader(file):
+    """
+    Goal: 将临时文件转为download_button可接受的只读文件对象(download_button不接受可写的文件对象)
+    Returns: BufferedReader
+    """
+    file.flush()
+    reader = open(file.fileno(), 'rb', closefd=False)
+    reader.file = file #保持临时文件的引用，避免其被回收关闭
+    reader.seek(0)
+    return reader
+
+def convert_package(final_result, entropy, meta):
+    """
+    Goal: 将结果导出为二进制结果包，结果表为GeoParquet格式(几何以WKB存储)
+    Args:
+        final_result[geodataframe]: 最终结果表
+        entropy[dataframe]: 各中心各中类功能的区位熵结果表
+        meta[dict]: 运行参数
+    Returns: File，zip包内含result.parquet、entropy.parquet、meta.json
+    """
+    file = tempfile.TemporaryFile()
+    with zipfile.ZipFile(file, 'w') as package:
+        #几何与结果表重复，区位熵表按center_id关联
+        for member, df in [('result.parquet', final_result), ('entropy.parquet', entropy.drop(columns=['geometry']))]:
+            part, _ = export_df(df, 'Parquet')
+            with package.open(member, 'w') as target:
+                shutil.copyfileobj(part, target)
+            part.close()
+        package.writestr('meta.json', json.dumps(meta, ensure_ascii=False))
+    return file_reader(file)
+
+@st.cache(allow_output_mutation=True)
+def load_result(content, file_name):
+    """
+    Goal: 读取结果文件并解析几何，结果被缓存，重复调整可视化参数时无需重新解析
+    Args:
+        content[bytes]: 上传的文件内容
+        file_name[str]: 文件名，用于判断格式及压缩方式
+    Returns:
+        df[geodataframe]: 结果表
+        entropy[dataframe]: 区位熵结果表，非结果包时为None
+        meta[dict]: 运行参数，非结果包时为None
+    """
+    entropy, meta = None, None
+    suffixes = file_name.lower().split('.')
+    suffix = suffixes.pop()
+    #解压导出时压缩的结果文件
+    if suffix == 'gz':
+        content = gzip.decompress(content)
+        suffix = suffixes.pop()
+    elif suffix == 'zst':
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(content)) as reader:
+            content = reader.read()
+        suffix = suffixes.pop()
+    if suffix == 'zip':
+        with zipfile.ZipFile(io.BytesIO(content)) as package:
+            df = gpd.read_parquet(io.BytesIO(package.read('result.parquet')))
+            entropy = pd.read_parquet(io.BytesIO(package.read('entropy.parquet')))
+            meta = json.loads(package.read('meta.json').decode('UTF-8'))
+    elif suffix == 'parquet':
+        df = gpd.read_parquet(io.BytesIO(content))
+    elif suffix == 'gpkg':
+        df = gpd.read_file(io.BytesIO(content))
+    else:
+        df = pd.read_csv(io.BytesIO(content), encoding = "UTF-8")
+        geometry = gpd.GeoSeries.from_wkt(df['geometry'])
+        df = gpd.GeoDataFrame(df, geometry=geometry, crs=4547)
+    return df, entropy, meta
       
 def parse_path(path):
     """
@@ -293,20 +842,67 @@ def create_grid(dfy, cellsize):
     '''
     sys_proj = '4547'
     
+    loc_all = grid_extent(dfy)
+    nets = lng_lat(loc_all, cellsize)
+    netfish = gpd.GeoDataFrame([getPolygon(i[0],i[1]) for i in nets],columns=['geometry'])
+    netfish = netfish.set_crs(epsg=sys_proj)
+    netfish = netfish.reset_index()
+    return netfish
+
+def grid_extent(dfy):
+    '''
+    Goals: 计算渔网范围，即分析范围外扩100米的矩形
+    Returns:
+        loc_all[str]: 矩形范围坐标串: 西,北,东,南
+    '''
     coord1 = (dfy['geometry'].total_bounds[0]-100, dfy['geometry'].total_bounds[3]+100)
     coord3 = (dfy['geometry'].total_bounds[2]+100, dfy['geometry'].total_bounds[1]-100)
     coord2 = (coord3[0],coord1[1])
     coord4 = (coord1[0],coord3[1])
     rectangle = Polygon([coord1,coord2,coord3,coord4])
     rectangle = gpd.GeoDataFrame([rectangle],columns=['geometry'])
-    rectangle = rectangle.set_crs(epsg=sys_proj)
+    rectangle = rectangle.set_crs(epsg='4547')
     coords = rectangle['geometry'].bounds.values[0]
     loc_all = '{},{},{},{}'.format(coords[0],coords[3],coords[2],coords[1])
-    nets = lng_lat(loc_all, cellsize)
-    netfish = gpd.GeoDataFrame([getPolygon(i[0],i[1]) for i in nets],columns=['geometry'])
-    netfish = netfish.set_crs(epsg=sys_proj)
-    netfish = netfish.reset_index()
-    return netfish
+    return loc_all
+
+def grid_axes(dfy, cellsize):
+    '''
+    Goals: 计算渔网的分割坐标，与create_grid生成的网格完全一致，网格编号index = 行号*列数+列号
+    Args: 
+        dfy[geodataframe]: 分析范围
+        cellsize[int]: 网格大小，单位：米
+    Returns:
+        lng[ndarray]: 由西向东的经向分割坐标
+        lat[ndarray]: 由北向南的纬向分割坐标
+    '''
+    loc_all = grid_extent(dfy)
+    lng = sorted(split_axis(float(loc_all.split(',')[2]), float(loc_all.split(',')[0]), cellsize))
+    lat = split_axis(float(loc_all.split(',')[1]), float(loc_all.split(',')[3]), cellsize)
+    return np.array(lng, dtype=float), np.array(lat, dtype=float)
+
+def bin_points(x, y, lng, lat):
+    '''
+    Goals: 计算点所在网格的行列号，与渔网contains相交的结果一致(落在网格边线上的点不属于任何网格)
+    Args: 
+        x, y[ndarray]: 投影坐标
+        lng, lat[ndarray]: grid_axes得到的分割坐标
+    Returns:
+        row, col[ndarray]: 行列号，不在任何网格内的点为-1
+    '''
+    col = np.searchsorted(lng, x, side='left') - 1
+    row = np.searchsorted(-lat, -y, side='left') - 1
+    inside = (col >= 0) & (col < len(lng)-1) & (row >= 0) & (row < len(lat)-1)
+    inside[inside] = (x[inside] != lng[col[inside]+1]) & (y[inside] != lat[row[inside]+1])
+    return np.where(inside, row, -1), np.where(inside, col, -1)
+
+def cell_polygons(index, lng, lat):
+    '''
+    Goals: 根据网格编号生成网格geometry
+    Returns: GeoSeries
+    '''
+    row, col = np.divmod(np.asarray(index), len(lng)-1)
+    return gpd.GeoSeries(shapely.box(lng[col], lat[row+1], lng[col+1], lat[row]), crs='EPSG:4547')
         
 #切割渔网所需函数
 def lng_lat(loc_all, div):
@@ -316,15 +912,9 @@ def lng_lat(loc_all, div):
     latH = float(loc_all.split(',')[1])
     latL = float(loc_all.split(',')[3])
     #按照一个数值切割纬度
-    lat_ls = [str(latH)]
-    while latH - latL > 0:
-        latH = latH - div
-        lat_ls.append('{:.2f}'.format(latH))
+    lat_ls = split_axis(latH, latL, div)
     #按照一个数值切割经度
-    lng_ls = [str(lngH)]
-    while lngH - lngL > 0:
-        lngH = lngH - div
-        lng_ls.append('{:.2f}'.format(lngH))
+    lng_ls = split_axis(lngH, lngL, div)
     #获取经纬度列表
     lat = lat_ls
     lng = sorted(lng_ls)
@@ -346,6 +936,14 @@ def lng_lat(loc_all, div):
             lsta.append(coords)
     return lsta
 
+def split_axis(high, low, div):
+    #按照一个数值由高到低切割坐标
+    ls = [str(high)]
+    while high - low > 0:
+        high = high - div
+        ls.append('{:.2f}'.format(high))
+    return ls
+
 def getPolygon(coord1,coord3):
     coord1 = coord1
     coord3 = coord3
@@ -751,8 +1349,21 @@ def explore_center(df_result, geo_relation, p_value, threshold):
         center_result = center_result.append({'center_id': i, 'geometry': polygon, 'area': polygon.area, 'num_poi': sum(temp_center['id'])}, ignore_index=True)
         i += 1
 
+    center_result = rank_center(center_result, threshold, sum(df_result['id']))
+    return center_result, polygons
+
+def rank_center(center_result, threshold, total_poi):
+    '''
+    Goals: 去除噪音中心，并根据面积及POI数量确定中心等级
+    Args: 
+        center_result[dataframe]: 含各中心面积、POI数量的结果表
+        threshold[float]: 去噪阈值
+        total_poi[int]: 网格内的POI总数
+    Returns:
+        center_result[dataframe]: 含各中心面积、POI数量、等级的结果表
+    '''
     #去除噪音
-    center_result = center_result[center_result['num_poi'] > threshold*sum(df_result['id'])]
+    center_result = center_result[center_result['num_poi'] > threshold*total_poi]
     
     #计算中心等级
     max_area = max(center_result['area'])
@@ -768,7 +1379,7 @@ def explore_center(df_result, geo_relation, p_value, threshold):
     level_3 = (center_result['level'].isnull())
     center_result.loc[level_3, ['level']] = '组团'
     
-    return center_result, polygons
+    return center_result
 
 def func_decider(dfo, center_result, polygons, threshold):
     '''
@@ -814,6 +1425,19 @@ def func_decider(dfo, center_result, polygons, threshold):
             elif item == '游憩功能':
                 entropy = entropy.append({'center_id': j, 'geometry': polygon, 'function': '游憩功能', 'LQ': LQ}, ignore_index=True)
         j += 1
+    final_result = decide_function(center_result, entropy, threshold)
+    return final_result, entropy
+
+def decide_function(center_result, entropy, threshold):
+    '''
+    Goals: 取各中心区位熵最大的功能为中心功能，最大区位熵不超过阈值的为综合功能
+    Args: 
+        center_result[dataframe]: 含各中心面积、POI数量、等级的结果表
+        entropy[dataframe]: 包含各中心各中类功能的区位熵结果表
+        threshold[float]: 判断为综合功能的区位熵临界点
+    Returns:
+        final_result[geodataframe]: 最终结果表
+    '''
     entropy_result = entropy.iloc[entropy.groupby('center_id')['LQ'].agg(pd.Series.idxmax)]
     decision = (entropy_result['LQ'] <= threshold)
     entropy_result.loc[decision, ['function']] = '综合功能'
@@ -821,7 +1445,496 @@ def func_decider(dfo, center_result, polygons, threshold):
     final_result = pd.merge(center_result, entropy_result[['center_id','function','LQ']], on='center_id', how='inner')
     final_result = gpd.GeoDataFrame(final_result, geometry=final_result['geometry'])
     final_result.crs = 'EPSG:4547'
-    return final_result, entropy
+    return final_result
+
+def tiled_analysis(df, dfy, cellsize, geo_relation, p_value, threshold, func_threshold, tile_cells=256, workers=4, kde=None):
+    '''
+    Goals: 分块并行计算中心范围、等级及功能，适用于省域等大范围、小网格的分析，结果与逐步计算一致
+           各分块在子进程中统计网格POI构成、计算局部G统计量或核密度，全局归一化及跨分块的中心合并在主进程中完成
+           不生成完整渔网及稠密栅格，分块按需切分提交，同时在途的分块不超过2倍进程数；
+           主进程仍保留全部POI坐标及有POI网格的指数表，内存占用随POI数量及有POI网格数增长
+    Args: 
+        df[geodataframe]: 重分类后的POI数据
+        dfy[geodataframe]: 分析范围
+        cellsize[int]: 网格大小，单位：米
+        geo_relation[str]: 空间关系: [Queen, Rook]
+        tile_cells[int]: 分块边长，单位：网格数
+        workers[int]: 并行进程数
+        kde[dict]: 可选参数，传入kde_cells的参数时以核密度识别中心，不再计算局部G统计量
+    Returns:
+        final_result[geodataframe]: 最终结果表
+        entropy[dataframe]: 包含各中心各中类功能的区位熵结果表
+        cells[dataframe]: 各网格的指数及显著度结果表
+    '''
+    lng, lat = grid_axes(dfy, cellsize)
+    nrow, ncol = len(lat)-1, len(lng)-1
+    row, col = bin_points(df.geometry.x.values, df.geometry.y.values, lng, lat)
+    keep = row >= 0
+    row, col = row[keep], col[keep]
+    index = row.astype(np.int64)*ncol + col
+    cls, classes = pd.factorize(df['小类'].values[keep])
+    mid = pd.Categorical(df['中类'].values[keep], categories=MID_CLASSES).codes
+    
+    #按分块划分POI
+    tile_cols = -(-ncol//tile_cells)
+    tile = (row//tile_cells)*tile_cols + col//tile_cells
+    order = np.argsort(tile, kind='stable')
+    starts = np.unique(tile[order], return_index=True)[1]
+    splits = np.split(order, starts[1:])
+    del row, col, tile, order
+    
+    limit = 2*workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        #各分块统计网格POI构成
+        tasks = ((cell_counts, index[i], cls[i], mid[i], len(classes)) for i in splits)
+        cells = pd.concat(bounded_map(executor, tasks, limit), ignore_index=True).sort_values('index', ignore_index=True)
+        del index, cls, mid, splits
+        
+        #全局归一化
+        cells = cell_index(cells, len(classes))
+        crow, ccol = np.divmod(cells['index'].values, ncol)
+        groups = pd.Series(np.arange(len(cells))).groupby([crow//tile_cells, ccol//tile_cells]).indices
+        if kde is not None:
+            #各分块连同带宽范围内的缓冲网格计算核密度，先求有POI网格的密度以确定全局阈值，再提取各分块的中心网格
+            kde = {'weight': 'CI', 'kernel': '高斯', 'bandwidth': 1000, 'quantile': 0.9, **kde}
+            weights = kde_kernel(cellsize, kde['kernel'], kde['bandwidth'])
+            halo = len(weights)//2
+            values = cells[kde['weight']].values
+            tasks = ((tile_kde, cells['index'].values[near], values[near], window, core, ncol, weights)
+                     for core, window, near in tile_windows(sorted(groups), groups, crow, ccol, nrow, ncol, tile_cells, halo))
+            density = pd.concat(bounded_map(executor, tasks, limit), ignore_index=True)
+            cells = pd.merge(cells, density, on='index', how='left')
+            cut = np.quantile(cells['density'], kde['quantile'])
+            reach = -(-halo//tile_cells)
+            tiles = sorted({(tr+r, tc+c) for (tr, tc) in groups for r in range(-reach, reach+1) for c in range(-reach, reach+1)
+                            if 0 <= tr+r < -(-nrow//tile_cells) and 0 <= tc+c < tile_cols})
+            tasks = ((tile_kde, cells['index'].values[near], values[near], window, core, ncol, weights, cut)
+                     for core, window, near in tile_windows(tiles, groups, crow, ccol, nrow, ncol, tile_cells, halo))
+            frames = list(bounded_map(executor, tasks, limit))
+        else:
+            #各分块连同一圈缓冲网格计算局部G统计量，全局矩由主进程计算
+            moments = (len(cells), cells['CI'].sum(), (cells['CI']**2).sum())
+            tasks = ((tile_hotspot, cells['index'].values[near], cells['CI'].values[near], window, core, ncol, geo_relation, moments, p_value)
+                     for core, window, near in tile_windows(sorted(groups), groups, crow, ccol, nrow, ncol, tile_cells, 1))
+            results = list(bounded_map(executor, tasks, limit))
+            hotspot = pd.concat([result[0] for result in results], ignore_index=True)
+            cells = pd.merge(cells, hotspot, on='index', how='left')
+            frames = [result[1] for result in results]
+            del results
+    
+    #合并跨分块边界的中心，计算等级及功能
+    center = stitch_centers(frames, ncol)
+    center_result, polygons = build_centers(center, cells, lng, lat)
+    center_result = rank_center(center_result, threshold, cells['id'].sum())
+    entropy = grid_entropy(center, cells, polygons)
+    final_result = decide_function(center_result, entropy, func_threshold)
+    return final_result, entropy, cells
+
+def bounded_map(executor, tasks, limit):
+    '''
+    Goals: 逐个提交任务，同时在途的任务不超过limit个，避免一次性切分并序列化全部分块
+    Args: 
+        executor[ProcessPoolExecutor]: 进程池
+        tasks[iterable]: (函数, 参数...)元组，按需生成
+        limit[int]: 在途任务数上限
+    Returns:
+        generator: 按提交顺序返回各任务结果
+    '''
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(*task))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def tile_windows(tiles, groups, crow, ccol, nrow, ncol, tile_cells, halo):
+    '''
+    Goals: 确定各分块连同缓冲网格的范围，及落在其中的有POI网格
+    Args: 
+        tiles[list]: 待计算的分块(行号, 列号)
+        groups[dict]: 各分块内有POI网格在网格表中的位置
+        crow, ccol[ndarray]: 有POI网格的行、列号
+        halo[int]: 缓冲网格圈数
+    Returns:
+        generator: 分块本身的范围core、连同缓冲网格的范围window(起始行, 起始列, 行数, 列数)及范围内网格的位置near，
+                   范围内没有POI网格的分块不返回
+    '''
+    reach = -(-halo//tile_cells)
+    for (tr, tc) in tiles:
+        core = (tr*tile_cells, tc*tile_cells, min(tile_cells, nrow-tr*tile_cells), min(tile_cells, ncol-tc*tile_cells))
+        r0, c0 = max(core[0]-halo, 0), max(core[1]-halo, 0)
+        window = (r0, c0, min(core[0]+core[2]+halo, nrow)-r0, min(core[1]+core[3]+halo, ncol)-c0)
+        near = [groups[(r, c)] for r in range(tr-reach, tr+reach+1) for c in range(tc-reach, tc+reach+1) if (r, c) in groups]
+        if not near:
+            continue
+        near = np.concatenate(near)
+        near = near[(crow[near] >= window[0]) & (crow[near] < window[0]+window[2]) & (ccol[near] >= window[1]) & (ccol[near] < window[1]+window[3])]
+        if len(near):
+            yield core, window, near
+
+def temporal_analysis(snapshots, dfy, cellsize, geo_relation, p_value, threshold, func_threshold):
+    '''
+    Goals: 多时相对比，各时相POI落入同一网格，逐时相计算指数、局部G统计量并识别中心，再匹配相邻时相的中心
+           未按(时相 × 网格 × 小类)一次性批量计算：该数组及(时相 × 渔网)的局部G统计量在小网格、大范围时占用内存过大，
+           改为逐时相仅统计有POI的网格，并在有POI网格的外包矩形内计算局部G统计量，结果与逐时相单独分析一致
+    Args: 
+        snapshots[dict]: 时相名称及对应的重分类后POI数据，按时间顺序排列
+        dfy[geodataframe]: 分析范围
+        cellsize[int]: 网格大小，单位：米
+        geo_relation[str]: 空间关系: [Queen, Rook]
+    Returns:
+        results[geodataframe]: 各时相的中心结果表，snapshot字段为时相名称
+        changes[dataframe]: 相邻时相的中心匹配及变化表
+    '''
+    lng, lat = grid_axes(dfy, cellsize)
+    ncol = len(lng)-1
+    
+    results, members = [], []
+    for label, df in snapshots.items():
+        #统计网格POI构成，小类总数为该时相出现的小类数
+        row, col = bin_points(df.geometry.x.values, df.geometry.y.values, lng, lat)
+        keep = row >= 0
+        index = row[keep].astype(np.int64)*ncol + col[keep]
+        cls, classes = pd.factorize(df['小类'].values[keep])
+        mid = pd.Categorical(df['中类'].values[keep], categories=MID_CLASSES).codes
+        cells = cell_index(cell_counts(index, cls, mid, len(classes)), len(classes))
+        del row, col, index, cls, mid
+        
+        #识别中心，计算等级及功能
+        center = hotspot_centers(cells, ncol, geo_relation, p_value)
+        center_result, polygons = build_centers(center, cells, lng, lat)
+        center_result = rank_center(center_result, threshold, cells['id'].sum())
+        entropy = grid_entropy(center, cells, polygons)
+        final_result = decide_function(center_result, entropy, func_threshold)
+        final_result.insert(0, 'snapshot', label)
+        results.append(final_result)
+        members.append(center[center['center_id'].isin(final_result['center_id'])])
+    changes = match_centers(list(snapshots), results, members)
+    results = gpd.GeoDataFrame(pd.concat(results, ignore_index=True), geometry='geometry', crs='EPSG:4547')
+    return results, changes
+
+def match_centers(labels, results, members):
+    '''
+    Goals: 按网格重叠匹配相邻时相的中心，计算面积、POI数量、等级及功能的变化
+    Args: 
+        labels[list]: 各时相名称
+        results[list]: 各时相的中心结果表
+        members[list]: 各时相的中心网格编号index及所属中心center_id
+    Returns:
+        changes[dataframe]: 中心匹配及变化表，status为: [延续, 合并, 分裂, 新增, 消失]
+    '''
+    columns = ['snapshot','center_id','area','num_poi','level','function']
+    frames = []
+    for s in range(len(results)-1):
+        before = results[s][columns].add_suffix('_from')
+        after = results[s+1][columns].add_suffix('_to')
+        overlap = pd.merge(members[s], members[s+1], on='index', suffixes=('_from','_to'))
+        overlap = overlap.groupby(['center_id_from','center_id_to']).size().rename('overlap').reset_index()
+        change = pd.merge(before, overlap, on='center_id_from', how='outer')
+        change = pd.merge(change, after, on='center_id_to', how='outer')
+        change['snapshot_from'] = labels[s]
+        change['snapshot_to'] = labels[s+1]
+        
+        #根据匹配关系判断变化类型
+        splits = change.groupby('center_id_from')['center_id_to'].transform('count')
+        merges = change.groupby('center_id_to')['center_id_from'].transform('count')
+        change.loc[change['center_id_from'].notnull() & change['center_id_to'].notnull(), 'status'] = '延续'
+        change.loc[splits > 1, 'status'] = '分裂'
+        change.loc[merges > 1, 'status'] = '合并'
+        change.loc[change['center_id_to'].isnull(), 'status'] = '消失'
+        change.loc[change['center_id_from'].isnull(), 'status'] = '新增'
+        frames.append(change.sort_values(['center_id_from','center_id_to'], ignore_index=True))
+    changes = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if len(changes):
+        changes[['center_id_from','center_id_to']] = changes[['center_id_from','center_id_to']].astype('Int64')
+        changes['overlap'] = changes['overlap'].fillna(0)
+        changes['area_change'] = changes['area_to'].fillna(0) - changes['area_from'].fillna(0)
+        changes['num_poi_change'] = changes['num_poi_to'].fillna(0) - changes['num_poi_from'].fillna(0)
+        changes['level_change'] = changes['level_from'].fillna('无') + '→' + changes['level_to'].fillna('无')
+        changes['function_change'] = changes['function_from'].fillna('无') + '→' + changes['function_to'].fillna('无')
+        changes = changes[['snapshot_from','snapshot_to','center_id_from','center_id_to','status','overlap','area_from','area_to','area_change',
+                           'num_poi_from','num_poi_to','num_poi_change','level_change','function_change']]
+    return changes
+
+def preview_analysis(df, dfy, cellsize, geo_relation, p_value, threshold, func_threshold, fraction, replicates=20, kde=None, seed=0):
+    '''
+    Goals: 快速预览，由抽样POI计算中心范围、等级及功能，并以bootstrap重抽样估计各中心的稳定性
+    Args: 
+        df[geodataframe]: 抽样并重分类后的POI数据
+        dfy[geodataframe]: 分析范围
+        cellsize[int]: 网格大小，单位：米
+        geo_relation[str]: 空间关系: [Queen, Rook]
+        fraction[float]: 抽样比例，网格POI数量按其折算
+        replicates[int]: bootstrap重抽样次数
+        kde[dict]: 可选参数，传入kde_cells的参数时以核密度识别中心
+    Returns:
+        final_result[geodataframe]: 预览结果表，增加检出率detect_rate、等级一致率level_agree、功能一致率function_agree，
+                                    及各中心范围内折算POI数量在重抽样中的90%区间num_poi_low、num_poi_high
+                                    (按预览中心自身的网格统计，不受重抽样中心范围变化的影响)
+    '''
+    lng, lat = grid_axes(dfy, cellsize)
+    row, col = bin_points(df.geometry.x.values, df.geometry.y.values, lng, lat)
+    keep = row >= 0
+    index = row[keep].astype(np.int64)*(len(lng)-1) + col[keep]
+    cls = pd.factorize(df['小类'].values[keep])[0]
+    mid = pd.Categorical(df['中类'].values[keep], categories=MID_CLASSES).codes
+    
+    center, cells = sample_centers(index, cls, mid, lng, lat, geo_relation, p_value, fraction, kde, cellsize)
+    center_result, polygons = build_centers(center, cells, lng, lat)
+    center_result = rank_center(center_result, threshold, cells['id'].sum())
+    entropy = grid_entropy(center, cells, polygons)
+    final_result = decide_function(center_result, entropy, func_threshold)
+    final_result['num_poi'] = final_result['num_poi'].round().astype(int)
+    members = center[center['center_id'].isin(final_result['center_id'])]
+    
+    #bootstrap重抽样，按网格重叠匹配各次结果中的中心
+    rng = np.random.default_rng(seed)
+    records, counts = [], []
+    for _ in range(replicates):
+        pick = rng.integers(0, len(index), len(index))
+        center_b, cells_b = sample_centers(index[pick], cls[pick], mid[pick], lng, lat, geo_relation, p_value, fraction, kde, cellsize)
+        counts.append(members['index'].map(cells_b.set_index('index')['id']).fillna(0).groupby(members['center_id'].values).sum())
+        summary = center_summary(center_b, cells_b, cellsize, threshold, func_threshold)
+        overlap = pd.merge(members, center_b[center_b['center_id'].isin(summary['center_id'])], on='index', suffixes=('','_b'))
+        overlap = overlap.groupby(['center_id','center_id_b']).size().rename('overlap').reset_index()
+        best = overlap.loc[overlap.groupby('center_id')['overlap'].idxmax()]
+        records.append(pd.merge(best, summary.rename(columns={'center_id': 'center_id_b'}), on='center_id_b'))
+    
+    final_result['detect_rate'] = final_result['level_agree'] = final_result['function_agree'] = np.nan
+    if replicates:
+        records = pd.concat(records, ignore_index=True)
+        records = pd.merge(records, final_result[['center_id','level','function']], on='center_id', suffixes=('_b',''))
+        records['level_agree'] = records['level_b'] == records['level']
+        records['function_agree'] = records['function_b'] == records['function']
+        grouped = records.groupby('center_id')
+        stability = pd.DataFrame({'detect_rate': grouped.size()/replicates,
+                                  'level_agree': grouped['level_agree'].sum()/replicates,
+                                  'function_agree': grouped['function_agree'].sum()/replicates})
+        counts = pd.concat(counts, axis=1)
+        interval = pd.DataFrame({'num_poi_low': counts.quantile(0.05, axis=1).round(), 'num_poi_high': counts.quantile(0.95, axis=1).round()})
+        final_result = final_result.drop(columns=['detect_rate','level_agree','function_agree'])
+        final_result = pd.merge(final_result, stability.rename_axis('center_id').reset_index(), on='center_id', how='left')
+        final_result = pd.merge(final_result, interval.rename_axis('center_id').reset_index(), on='center_id', how='left')
+        final_result[['detect_rate','level_agree','function_agree']] = final_result[['detect_rate','level_agree','function_agree']].fillna(0)
+    return gpd.GeoDataFrame(final_result, geometry='geometry', crs='EPSG:4547')
+
+def sample_centers(index, cls, mid, lng, lat, geo_relation, p_value, fraction, kde=None, cellsize=500):
+    '''
+    Goals: 由抽样POI计算网格指数并识别中心网格，网格POI数量按抽样比例折算
+    Args: 
+        index, cls, mid[ndarray]: 各POI所在网格编号、小类编码及中类编码；重抽样中缺失的小类在此重新编码
+        kde[dict]: 可选参数，传入kde_cells的参数时以核密度识别中心，否则使用局部G统计量
+    Returns:
+        center[dataframe]: 中心网格编号index及所属中心center_id
+        cells[dataframe]: 各网格的指数结果表
+    '''
+    cls, classes = pd.factorize(cls)
+    cells = cell_counts(index, cls, mid, len(classes))
+    cells['id'] = cells['id']/fraction
+    cells[MID_CLASSES] = cells[MID_CLASSES]/fraction
+    cells = cell_index(cells, len(classes))
+    if kde is not None:
+        return kde_cells(cells, lng, lat, cellsize, **kde), cells
+    return hotspot_centers(cells, len(lng)-1, geo_relation, p_value), cells
+
+def center_summary(center, cells, cellsize, threshold, func_threshold):
+    '''
+    Goals: 不生成中心范围，快速计算各中心的面积、POI数量、等级及功能，用于重抽样
+    Returns:
+        summary[dataframe]: 含各中心面积、POI数量、等级、功能的结果表
+    '''
+    num_poi = center['index'].map(cells.set_index('index')['id']).fillna(0).groupby(center['center_id']).sum()
+    summary = pd.DataFrame({'center_id': num_poi.index, 'area': center.groupby('center_id').size().values*cellsize**2, 'num_poi': num_poi.values})
+    summary = summary[summary['num_poi'] > threshold*cells['id'].sum()]
+    if summary.empty:
+        return summary.assign(level=None, function=None)
+    summary = rank_center(summary, threshold, cells['id'].sum())
+    entropy = grid_entropy(center, cells)
+    entropy = entropy.loc[entropy.groupby('center_id')['LQ'].idxmax()]
+    entropy.loc[entropy['LQ'] <= func_threshold, 'function'] = '综合功能'
+    return pd.merge(summary, entropy[['center_id','function']], on='center_id', how='inner')
+
+def cell_index(cells, n_cls):
+    '''
+    Goals: 根据网格POI构成计算功能密度、功能多样性及中心性指数，与calc_index一致
+    Args: 
+        cells[dataframe]: cell_counts得到的各网格POI构成
+        n_cls[int]: 小类总数
+    Returns:
+        cells[dataframe]: 增加De、De*、Di、Di*、CI字段的结果表
+    '''
+    cells['De'], cells['De*'], cells['Di'], cells['Di*'], cells['CI'] = centrality(cells['id'].values, cells['m'].values, cells['H'].values, n_cls)
+    return cells
+
+def centrality(n, m, H, n_cls):
+    '''
+    Goals: 计算功能密度、功能多样性及中心性指数，与calc_index一致
+    Args: 
+        n[ndarray]: 网格POI数量，无POI的网格为0，不参与计算
+        m[ndarray]: 网格小类数量
+        H[ndarray]: 网格小类构成的Σp·ln(p)值
+        n_cls[int]: 小类总数
+    Returns:
+        De, De*, Di, Di*, CI[ndarray]: 无POI的网格为nan
+    '''
+    mask = n > 0
+    De = np.where(mask, n/0.25, np.nan)
+    De_star = De/np.nanmax(De)
+    Di = np.where(mask, -1*(H/ln(n_cls)), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Di_star = Di/ln(m)
+    nonzero = np.where(mask & (Di > 0), Di, np.inf)
+    Di_star = np.where(mask & (m == 1), np.min(nonzero)/2, Di_star)
+    return De, De_star, Di, Di_star, De_star*Di_star
+
+def kde_center(df_result, lng, lat, cellsize, threshold, weight='CI', kernel='高斯', bandwidth=1000, quantile=0.9):
+    '''
+    Goals: 基于核密度识别中心范围，再根据面积及POI数量确定中心等级，结果格式与explore_center一致
+    Args: 
+        df_result[dataframe]: 各网格指数结果表
+        lng, lat[ndarray]: grid_axes得到的分割坐标
+        cellsize[int]: 网格大小，单位：米
+        threshold[float]: 去噪阈值
+        其余参数见kde_cells
+    Returns:
+        center_result[dataframe]: 含各中心面积、POI数量、等级的结果表
+        polygons[geodataframe]: 包含每个独立的中心范围
+    '''
+    center = kde_cells(df_result, lng, lat, cellsize, weight, kernel, bandwidth, quantile)
+    center_result, polygons = build_centers(center, df_result, lng, lat)
+    center_result = rank_center(center_result, threshold, sum(df_result['id']))
+    return center_result, polygons
+
+def kde_cells(cells, lng, lat, cellsize, weight='CI', kernel='高斯', bandwidth=1000, quantile=0.9):
+    '''
+    Goals: 将网格指标栅格化，以FFT卷积进行核密度平滑，提取高于阈值的连片区域作为中心
+    Args: 
+        cells[dataframe]: 各网格指数结果表，需包含index、id及weight字段，计算后增加density字段
+        lng, lat[ndarray]: grid_axes得到的分割坐标
+        cellsize[int]: 网格大小，单位：米
+        weight[str]: 栅格化的网格指标: [CI, id]
+        kernel[str]: 核函数: [高斯, Epanechnikov, 四次]
+        bandwidth[float]: 带宽，单位：米
+        quantile[float]: 分位数，核密度高于有POI网格该分位数的区域为中心区
+    Returns:
+        center[dataframe]: 中心网格编号index及所属中心center_id，按网格编号排序
+    '''
+    nrow, ncol = len(lat)-1, len(lng)-1
+    row, col = np.divmod(cells['index'].values.astype(np.int64), ncol)
+    raster = np.zeros((nrow, ncol))
+    raster[row, col] = cells[weight].values
+    
+    #FFT卷积平滑，去除浮点误差带来的负值
+    density = np.clip(signal.fftconvolve(raster, kde_kernel(cellsize, kernel, bandwidth), mode='same'), 0, None)
+    cells['density'] = density[row, col]
+    
+    #按分位数阈值提取中心区，共边相连的网格为同一中心
+    cut = np.quantile(cells['density'], quantile)
+    labels, _ = ndimage.label((density >= cut) & (density > 0))
+    lr, lc = np.nonzero(labels)
+    center = pd.DataFrame({'index': lr*ncol + lc, 'center_id': pd.factorize(labels[lr, lc])[0]})
+    return center
+
+def kde_kernel(cellsize, kernel='高斯', bandwidth=1000):
+    '''
+    Goals: 生成以网格为单位的核函数权重，高斯核截断于3倍带宽
+    Returns:
+        weights[ndarray]: 边长为奇数、总和为1的权重矩阵
+    '''
+    h = bandwidth/cellsize
+    radius = int(np.ceil(3*h if kernel == '高斯' else h))
+    dy, dx = np.mgrid[-radius:radius+1, -radius:radius+1]
+    u2 = (dx**2 + dy**2)/h**2
+    if kernel == '高斯':
+        weights = np.exp(-u2/2)
+    elif kernel == 'Epanechnikov':
+        weights = np.clip(1 - u2, 0, None)
+    elif kernel == '四次':
+        weights = np.clip(1 - u2, 0, None)**2
+    return weights/weights.sum()
+
+def hotspot_centers(cells, ncol, geo_relation, p_value):
+    '''
+    Goals: 在有POI网格的外包矩形内计算局部G统计量，共边相连的中心网格为同一中心；外包矩形以外均为无POI网格，结果与在整个渔网上计算一致
+    Args: 
+        cells[dataframe]: 各网格指数结果表，需包含index、CI字段
+        ncol[int]: 渔网列数
+    Returns:
+        center[dataframe]: 中心网格编号index及所属中心center_id
+    '''
+    row, col = np.divmod(cells['index'].values.astype(np.int64), ncol)
+    r0, c0 = row.min(), col.min()
+    values = np.zeros((row.max()-r0+1, col.max()-c0+1))
+    mask = np.zeros(values.shape, dtype=bool)
+    values[row-r0, col-c0] = cells['CI'].values
+    mask[row-r0, col-c0] = True
+    z, p = local_g(values, mask, geo_relation)
+    labels, _ = ndimage.label(mask & (z > 0) & (p/2 < p_value))
+    lr, lc = np.nonzero(labels)
+    return pd.DataFrame({'index': (lr+r0)*ncol + lc+c0, 'center_id': pd.factorize(labels[lr, lc])[0]})
+
+def stitch_centers(frames, ncol):
+    '''
+    Goals: 合并跨分块边界的中心连片
+    Args: 
+        frames[list]: 各分块的中心网格及其分块内的连片编号
+        ncol[int]: 渔网列数
+    Returns:
+        center[dataframe]: 中心网格编号index及所属中心center_id，按网格编号排序
+    '''
+    offset = 0
+    for frame in frames:
+        frame['label'] += offset
+        offset = frame['label'].max()+1 if len(frame) else offset
+    center = pd.concat(frames, ignore_index=True).sort_values('index', ignore_index=True)
+    
+    #共边相邻但分属不同分块的中心网格
+    lookup = pd.Series(center['label'].values, index=center['index'].values)
+    index = center['index'].values
+    right = index[index % ncol != ncol-1]
+    source = np.concatenate([right, index])
+    target = lookup.reindex(np.concatenate([right+1, index+ncol])).values
+    found = ~np.isnan(target)
+    graph = sparse.coo_matrix((np.ones(found.sum()), (lookup[source[found]].values, target[found].astype(np.int64))), shape=(offset, offset))
+    _, component = connected_components(graph, directed=False)
+    center['center_id'] = pd.factorize(component[center['label'].values])[0]
+    return center[['index','center_id']]
+
+def build_centers(center, cells, lng, lat):
+    '''
+    Goals: 由中心网格生成各中心范围，并计算面积及POI数量
+    Args: 
+        center[dataframe]: 中心网格编号index及所属中心center_id
+        cells[dataframe]: 各网格的POI数量
+        lng, lat[ndarray]: grid_axes得到的分割坐标
+    Returns:
+        center_result[dataframe]: 含各中心面积、POI数量的结果表
+        polygons[geodataframe]: 包含每个独立的中心范围
+    '''
+    grid = gpd.GeoDataFrame(center, geometry=cell_polygons(center['index'].values, lng, lat).values, crs='EPSG:4547')
+    grid['num_poi'] = center['index'].map(cells.set_index('index')['id']).fillna(0).values
+    polygons = grid.dissolve(by='center_id', aggfunc={'num_poi': 'sum'}).reset_index()
+    center_result = pd.DataFrame({'center_id': polygons['center_id'], 'geometry': polygons.geometry.values, 'area': polygons.area, 'num_poi': polygons['num_poi']})
+    return center_result, polygons[['center_id','geometry']]
+
+def grid_entropy(center, cells, polygons=None):
+    '''
+    Goals: 由网格的中类POI数量计算各中心各中类功能的区位熵，与func_decider一致
+    Args: 
+        center[dataframe]: 中心网格编号index及所属中心center_id
+        cells[dataframe]: 各网格的POI数量id及各中类的POI数量，区位熵以含无中类POI在内的POI数量为分母
+        polygons[geodataframe]: 可选参数，包含每个独立的中心范围，不传入时结果不含geometry
+    Returns:
+        entropy[dataframe]: 包含各中心各中类功能的区位熵结果表
+    '''
+    local = cells.set_index('index')[MID_CLASSES+['id']].reindex(center['index'], fill_value=0).groupby(center['center_id'].values).sum()
+    total = cells[MID_CLASSES+['id']].sum()
+    LQ = local[MID_CLASSES].div(local['id'], axis=0)/(total[MID_CLASSES]/total['id'])
+    entropy = LQ.stack()[local[MID_CLASSES].stack() > 0].rename('LQ').rename_axis(['center_id','function']).reset_index()
+    if polygons is not None:
+        entropy.insert(1, 'geometry', entropy['center_id'].map(polygons.set_index('center_id')['geometry']))
+    return entropy
 
 if __name__ == "__main__":
     main()